@@ -0,0 +1,114 @@
+import numpy as np
+from match_books import BookVectorIndex
+from metrics import BOOKS_SCORED
+
+
+class IVFIndex(BookVectorIndex):
+    """Approximate search: book vectors are partitioned by spherical k-means into n_lists inverted lists.
+
+    A query is scored only against the books of the n_probe lists with the closest centroids, so its cost is
+    about n_probe / n_lists of the exact search. n_probe is the recall/latency knob (n_probe = n_lists is exact).
+    Books can be added and removed without retraining, removed rows are compacted once they are the majority.
+    """
+
+    def __init__(self, vectors: np.ndarray, book_ids: np.ndarray, n_lists: int = None, n_probe: int = 8,
+                 centroids: np.ndarray = None, n_iter: int = 10, seed: int = 0) -> None:
+        super().__init__(vectors, book_ids)
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        n_lists = n_lists or max(1, int(np.sqrt(len(self.book_ids))))
+        self.centroids = centroids if centroids is not None else self.train_centroids(self.matrix, n_lists, n_iter, seed)
+        self._alive = np.ones(len(self.book_ids), dtype=bool)
+        self._assign_lists()
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    @staticmethod
+    def train_centroids(matrix: np.ndarray, n_lists: int, n_iter: int = 10, seed: int = 0, max_samples_per_list: int = 64):
+        """Spherical k-means on a sample of normalized vectors."""
+        rng = np.random.default_rng(seed)
+        matrix = matrix[np.linalg.norm(matrix, axis=1) > 0]
+        if len(matrix) == 0:
+            return np.zeros((1, matrix.shape[1]), dtype=np.float32)
+
+        n_lists = min(n_lists, len(matrix))
+        sample = matrix[rng.choice(len(matrix), min(len(matrix), n_lists * max_samples_per_list), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=n_lists)
+            non_empty = counts > 0
+            centroids = np.zeros_like(centroids)
+            centroids[non_empty] = np.add.reduceat(sample[order], np.cumsum(counts)[non_empty] - counts[non_empty])
+            # Empty list gets a random point, so all lists stay in use
+            empty = ~non_empty
+            centroids[empty] = sample[rng.integers(len(sample), size=int(empty.sum()))]
+            centroids = BookVectorIndex.normalize(centroids)
+        return centroids
+
+    def _assign_lists(self):
+        assignment = np.argmax(self.matrix @ self.centroids.T, axis=1) if len(self.matrix) else np.zeros(0, dtype=np.int64)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(self.n_lists + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(self.n_lists)]
+        self._list_of = assignment
+
+    def search(self, query_vectors: np.ndarray, k: int = 10, threshold: float = 0.65, mask: np.ndarray = None):
+        query_vectors = self.normalize(query_vectors)
+        n_probe = min(self.n_probe, self.n_lists)
+        probes = np.argpartition(-(query_vectors @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+
+        results = []
+        for query_vector, probe in zip(query_vectors, probes):
+            rows = np.concatenate([self.lists[c] for c in probe])
+            rows = rows[self._alive[rows]]
+            if mask is not None:
+                rows = rows[mask[self.book_ids[rows]]]
+            BOOKS_SCORED.inc(len(rows))
+            results.append(self.top_k(self.book_ids[rows], self.matrix[rows] @ query_vector, k, threshold))
+        return results
+
+    def copy(self):
+        index = super().copy()
+        index._alive = self._alive.copy()
+        index.lists = list(self.lists)
+        return index
+
+    def add(self, book_ids: np.ndarray, vectors: np.ndarray):
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        self.remove(book_ids)
+        vectors = self.normalize(vectors).reshape(len(book_ids), -1)
+
+        start = len(self.book_ids)
+        self._row_of.update({book_id: start + i for i, book_id in enumerate(book_ids.tolist())})
+        self.book_ids = np.concatenate([self.book_ids, book_ids])
+        self.matrix = np.vstack([self.matrix, vectors])
+        self._alive = np.concatenate([self._alive, np.ones(len(book_ids), dtype=bool)])
+
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        self._list_of = np.concatenate([self._list_of, assignment])
+        for c in np.unique(assignment):
+            self.lists[c] = np.concatenate([self.lists[c], start + np.flatnonzero(assignment == c)])
+
+    def remove(self, book_ids: np.ndarray):
+        for book_id in np.asarray(book_ids).tolist():
+            row = self._row_of.pop(book_id, None)
+            if row is not None:
+                self._alive[row] = False
+
+        # Compact when most of the rows are removed
+        if len(self._alive) and self._alive.sum() < len(self._alive) / 2:
+            self.book_ids, self.matrix = self.book_ids[self._alive], self.matrix[self._alive]
+            self._row_of = {book_id: row for row, book_id in enumerate(self.book_ids.tolist())}
+            self._alive = np.ones(len(self.book_ids), dtype=bool)
+            self._assign_lists()
+
+
+VECTOR_INDEXES = {"exact": BookVectorIndex, "ivf": IVFIndex}
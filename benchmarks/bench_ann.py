@@ -0,0 +1,67 @@
+"""Recall@10 and QPS of the approximate (IVF) embedding index against exact search.
+
+The catalog is scaled synthetically from the stored book vectors: every new book is a stored vector with noise.
+Usage: python benchmarks/bench_ann.py [--n-books 100000] [--n-queries 500] [--n-probe 1 2 4 8 16]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore
+from match_books import BookVectorIndex
+
+
+def get_vectors(n_books: int, n_queries: int, noise: float = 0.3, seed: int = 0, path: str = "embeddings/w2v_avg_vectors"):
+    rng = np.random.default_rng(seed)
+    base = BookVectorIndex.normalize(EmbeddingStore.load(path).vectors)
+    base = base[np.linalg.norm(base, axis=1) > 0]
+
+    def sample(n):
+        vectors = base[rng.integers(len(base), size=n)]
+        return (vectors + noise * rng.standard_normal(vectors.shape) / np.sqrt(vectors.shape[1])).astype(np.float32)
+    return sample(n_books), sample(n_queries)
+
+
+def measure(index, queries: np.ndarray, k: int, threshold: float, batch_size: int = 1):
+    start = time.perf_counter()
+    results = []
+    for i in range(0, len(queries), batch_size):
+        results.extend(index.search(queries[i:i + batch_size], k, threshold))
+    elapsed = time.perf_counter() - start
+    return [set(ids.tolist()) for ids, _ in results], len(queries) / elapsed
+
+
+def run(n_books: int, n_queries: int, n_probes: list, k: int = 10, threshold: float = 0.65):
+    vectors, queries = get_vectors(n_books, n_queries)
+    book_ids = np.arange(n_books)
+
+    exact = BookVectorIndex(vectors, book_ids)
+    truth, exact_qps = measure(exact, queries, k, threshold)
+    results = [{"index": "exact", "n_probe": None, "recall@10": 1.0, "qps": exact_qps}]
+
+    start = time.perf_counter()
+    ivf = IVFIndex(vectors, book_ids)
+    build_s = time.perf_counter() - start
+    for n_probe in n_probes:
+        ivf.n_probe = n_probe
+        found, qps = measure(ivf, queries, k, threshold)
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth) if t])
+        results.append({"index": f"ivf({ivf.n_lists} lists, built in {build_s:.1f}s)", "n_probe": n_probe,
+                        "recall@10": float(recall), "qps": qps})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare approximate and exact embedding search.")
+    parser.add_argument("--n-books", type=int, default=100000)
+    parser.add_argument("--n-queries", type=int, default=500)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    print(f"{'index':>40}{'n_probe':>10}{'recall@10':>12}{'qps':>12}")
+    for res in run(args.n_books, args.n_queries, args.n_probe):
+        print(f"{res['index']:>40}{str(res['n_probe']):>10}{res['recall@10']:>12.3f}{res['qps']:>12.1f}")
@@ -0,0 +1,52 @@
+"""Parse microbenchmark: html.parser (BeautifulSoup) vs lxml backend on pages of the book shop.
+
+Usage: python benchmarks/bench_parsers.py [--pages-dir saved_site/] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers import PARSERS
+from site_snapshot import get_book_names, load_saved_pages, render_site
+
+
+def get_pages(pages_dir: str = None):
+    pages = load_saved_pages(pages_dir) if pages_dir else render_site(get_book_names())
+    index = [html for path, html in pages.items() if path == "/index.html"]
+    categories = [html for path, html in pages.items() if "/category/" in path]
+    books = [html for path, html in pages.items() if path.startswith("/catalogue/") and "/category/" not in path]
+    return {"index": (index, "parse_category_links"),
+            "category": (categories, "parse_category_page"),
+            "book": (books, "parse_book_page")}
+
+
+def run(pages_dir: str = None, repeat: int = 3):
+    results = dict()
+    for kind, (markups, method) in get_pages(pages_dir).items():
+        outputs = dict()
+        for name, parser_cls in PARSERS.items():
+            parse = getattr(parser_cls(), method)
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                outputs[name] = [parse(markup) for markup in markups]
+                best = min(best, time.perf_counter() - start)
+            results[(kind, name)] = (len(markups), best)
+
+        assert outputs["lxml"] == outputs["html.parser"], f"Parsers disagree on {kind} pages"
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare parser backends.")
+    parser.add_argument("--pages-dir", type=str, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.pages_dir, args.repeat)
+    print(f"{'pages':>10}{'parser':>14}{'count':>8}{'pages/s':>12}{'speedup':>10}")
+    for (kind, name), (count, elapsed) in results.items():
+        speedup = results[(kind, "html.parser")][1] / elapsed
+        print(f"{kind:>10}{name:>14}{count:>8}{count / elapsed:>12.1f}{speedup:>9.1f}x")
@@ -0,0 +1,108 @@
+"""Load test of the REST API: p50/p99 latency and throughput at increasing concurrency.
+
+Every client thread sends /simple/<query> requests back to back for the given duration, queries are book names.
+Without --url the API is started in-process (threaded Werkzeug server) on the offline copy of the shop
+from site_snapshot, so nothing leaves the machine. With --url an already running server is tested
+(e.g. started by serve.py).
+Usage: python benchmarks/load_test.py [--url http://127.0.0.1:5000] [--concurrency 1 2 4 8 16 32] [--duration 10]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from site_snapshot import SiteServer, get_book_names, render_site
+
+
+def get_queries(n_queries: int = 1000, seed: int = 0):
+    rng = random.Random(seed)
+    names = get_book_names()
+    # Prefixes of book names, so both simple and embedding matches are exercised
+    return [" ".join(name.split()[:rng.randint(1, 3)]) for name in rng.sample(names, min(n_queries, len(names)))]
+
+
+def start_local_api(n_books: int = None):
+    """Shop and API on local ports, returns (shop, api url)."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import rest
+    import search_data
+
+    shop = SiteServer(render_site(get_book_names(n_books=n_books)))
+    shop.__enter__()
+    search_data.BookSearchScraper.BOOK_SHOP_URL = shop.base_url + "/index.html"
+    search_data.BookSearchScraper.BOOK_SHOP_BASE_URL = shop.base_url
+    # Local shop, not rate limited
+    rest.BOOK_SCRAPER = search_data.BookSearchScraper(cache_update_ts=300, rate_limit=None)
+    rest.BOOK_SCRAPER.refresh_snapshot()
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, rest.api, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return shop, f"http://127.0.0.1:{server.server_port}"
+
+
+def client(url: str, queries: list, deadline: float, seed: int):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url + "/simple/" + quote(rng.choice(queries)), timeout=30) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except (urllib.error.URLError, OSError):
+            errors += 1
+    return latencies, errors
+
+
+def run(url: str, queries: list, concurrencies: list, duration: float):
+    results = []
+    for concurrency in concurrencies:
+        deadline = time.perf_counter() + duration
+        with ThreadPoolExecutor(concurrency) as executor:
+            outputs = list(executor.map(lambda i: client(url, queries, deadline, i), range(concurrency)))
+
+        latencies = np.array([latency for output, _ in outputs for latency in output]) * 1000
+        results.append({
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": sum(errors for _, errors in outputs),
+            "throughput_rps": len(latencies) / duration,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency percentiles and throughput of the REST API under load.")
+    parser.add_argument("--url", default=None, help="running API, default starts one on a local copy of the shop")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--n-books", type=int, default=None, help="books of the local shop, default all stored")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    shop, url = (None, args.url) if args.url else start_local_api(args.n_books)
+    results = run(url, get_queries(), args.concurrency, args.duration)
+    if shop is not None:
+        shop.__exit__(None, None, None)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'concurrency':>12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for res in results:
+            print(f"{res['concurrency']:>12}{res['requests']:>10}{res['errors']:>8}{res['throughput_rps']:>10.1f}"
+                  f"{res['p50_ms'] or 0:>10.1f}{res['p99_ms'] or 0:>10.1f}")
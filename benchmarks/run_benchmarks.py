@@ -0,0 +1,172 @@
+"""Benchmark suite over the offline copy of the shop, results are written as JSON to compare across commits.
+
+For every catalog size (synthetic catalogs scaled from the stored book names, served by site_snapshot):
+cold crawl and incremental refresh time, query latency (p50/p99) and QPS with and without the result cache,
+cost of embedding vs simple (token) matching per query, and peak memory. Parser throughput is measured once.
+Usage: python benchmarks/run_benchmarks.py [--n-books 1000 100000 1000000] [--out results.json]
+       python benchmarks/run_benchmarks.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bench_parsers
+from caching import LRUCache
+from site_snapshot import SiteServer, get_book_names, render_site
+
+
+def get_meta():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "timestamp": time.time(), "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def get_queries(names: list, n_queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Prefixes of book names, so both simple and embedding matches are found
+    return [" ".join(names[i].split()[:rng.integers(1, 4)]) for i in rng.integers(len(names), size=n_queries)]
+
+
+def percentiles_ms(latencies: list):
+    latencies = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+def peak_rss_mb():
+    # Peak of the process so far, kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_crawl(scraper):
+    start = time.perf_counter()
+    scraper.refresh_snapshot()
+    cold_s = time.perf_counter() - start
+
+    # Nothing changed, all pages are answered with 304
+    start = time.perf_counter()
+    scraper.refresh_snapshot()
+    refresh_s = time.perf_counter() - start
+    return {"cold_crawl_s": cold_s, "incremental_refresh_s": refresh_s,
+            "pages": len(scraper._pages), "books": len(scraper.snapshot)}
+
+
+def bench_queries(scraper, queries: list):
+    results = dict()
+    for name, cache in [("uncached", LRUCache(max_entries=0)), ("cached", scraper.result_cache)]:
+        scraper.result_cache = cache
+        # Warm up query preprocessing caches (and the result cache if it is used)
+        scraper.collect_search_data_batch(queries, extended_info=True, search_all_pages=True)
+        latencies = []
+        start = time.perf_counter()
+        for query in queries:
+            query_start = time.perf_counter()
+            scraper.collect_search_data(query, extended_info=True, search_all_pages=True)
+            latencies.append(time.perf_counter() - query_start)
+        results[name] = dict(percentiles_ms(latencies), qps=len(queries) / (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    scraper.result_cache = LRUCache(max_entries=0)
+    scraper.collect_search_data_batch(queries, extended_info=True, search_all_pages=True)
+    results["batch_uncached_qps"] = len(queries) / (time.perf_counter() - start)
+    return results
+
+
+def bench_matcher(scraper, queries: list):
+    """Microseconds per query of every matching step, on the current snapshot."""
+    snapshot, matcher = scraper.get_snapshot(), scraper.matcher
+    queries_clean = [matcher.preprocess_query(query) for query in queries]
+    matcher.vector_cache.clear()
+
+    def per_query_us(func, items):
+        start = time.perf_counter()
+        outputs = [func(item) for item in items]
+        return (time.perf_counter() - start) / len(items) * 1e6, outputs
+
+    embed_us, vectors = per_query_us(lambda query: matcher.get_embedding_vector(query), queries_clean)
+    embedding_us, _ = per_query_us(lambda vector: snapshot.book_index.search(vector[None], scraper.best_k_matches), vectors)
+    simple_us, _ = per_query_us(snapshot.token_index.search, queries_clean)
+    return {"embed_query_us": embed_us, "embedding_match_us": embedding_us, "simple_match_us": simple_us}
+
+
+def run_scale(n_books: int, n_queries: int, n_categories: int, vector_index: str):
+    import search_data
+
+    names = get_book_names(n_books=n_books)
+    with SiteServer(render_site(names, n_categories, book_pages=False)) as site:
+        search_data.BookSearchScraper.BOOK_SHOP_URL = site.base_url + "/index.html"
+        search_data.BookSearchScraper.BOOK_SHOP_BASE_URL = site.base_url
+        # Local shop, crawl as fast as possible and to the end
+        scraper = search_data.BookSearchScraper(cache_update_ts=3600, vector_index=vector_index, rate_limit=None, crawl_timeout=None)
+        crawl = bench_crawl(scraper)
+
+    queries = get_queries(names, n_queries)
+    return {"n_books": n_books, "vector_index": vector_index, "crawl": crawl,
+            "query": bench_queries(scraper, queries), "matcher": bench_matcher(scraper, queries),
+            "memory": {"peak_rss_mb": peak_rss_mb()}}
+
+
+def bench_all_parsers(repeat: int = 3):
+    results = dict()
+    for (kind, name), (count, elapsed) in bench_parsers.run(repeat=repeat).items():
+        results.setdefault(kind, dict())[name + "_pages_per_s"] = count / elapsed
+    return results
+
+
+def compare(old: dict, new: dict, prefix: str = ""):
+    """Ratio new / old of every number found in both results."""
+    for key, value in new.items():
+        if key not in old or key == "meta":
+            continue
+        if isinstance(value, dict):
+            compare(old[key], value, prefix + key + ".")
+        elif isinstance(value, list):
+            # Catalog sizes are matched by number of books
+            old_items = {item["n_books"]: item for item in old[key]}
+            for new_item in value:
+                if new_item["n_books"] in old_items:
+                    compare(old_items[new_item["n_books"]], new_item, f"{prefix}{key}[{new_item['n_books']}].")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and old[key]:
+            print(f"{prefix + key:<60}{old[key]:>14.3f}{value:>14.3f}{value / old[key]:>9.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of crawling, searching and parsing on an offline shop.")
+    parser.add_argument("--n-books", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="catalog sizes, e.g. 1000 100000 1000000")
+    parser.add_argument("--n-queries", type=int, default=500)
+    parser.add_argument("--n-categories", type=int, default=50)
+    parser.add_argument("--vector-index", choices=["exact", "ivf"], default="exact")
+    parser.add_argument("--out", default=None, help="default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as fp_old, open(args.compare[1]) as fp_new:
+            old, new = json.load(fp_old), json.load(fp_new)
+        print(f"{'metric':<60}{old['meta']['commit'] or 'old':>14}{new['meta']['commit'] or 'new':>14}{'ratio':>10}")
+        compare(old, new)
+        sys.exit(0)
+
+    results = {"meta": get_meta(), "parsers": bench_all_parsers(), "scales": []}
+    # Smallest catalog first, so the peak memory of every size is not hidden by a larger one
+    for n_books in sorted(args.n_books):
+        print(f"Benchmarking {n_books} books.")
+        results["scales"].append(run_scale(n_books, args.n_queries, args.n_categories, args.vector_index))
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"{results['meta']['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {out}")
@@ -0,0 +1,219 @@
+"""Offline stand-in for books.toscrape.com.
+
+Renders the catalog with the same markup as the real site (index, category pages with pagination
+and book pages) and serves it from a local HTTP server, so crawls and parsing can be benchmarked
+without touching the upstream host. Saved pages of the real site can be served instead with --pages-dir.
+Latency and errors can be injected (--latency, --error-rate) to check crawling of a slow or failing host.
+"""
+import argparse
+import hashlib
+import os
+import json
+import random
+import threading
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RATINGS = ["One", "Two", "Three", "Four", "Five"]
+BOOKS_PER_PAGE = 20
+
+
+def get_book_names(path_in: str = "embeddings/w2v_avg_vectors.names.json", n_books: int = None):
+    """Book names of the real catalog, repeated with a suffix to scale the catalog synthetically."""
+    with open(path_in, encoding="utf-8") as fp:
+        names = [name.title() for name in json.load(fp)]
+
+    n_books = len(names) if n_books is None else n_books
+    return [names[i % len(names)] + (f" vol. {i // len(names)}" if i >= len(names) else "") for i in range(n_books)]
+
+
+def _slug(text: str, i: int):
+    return "".join(c if c.isascii() and c.isalnum() else "-" for c in text.lower())[:40] + f"_{i}"
+
+
+def render_site(names: list, n_categories: int = 50, book_pages: bool = True):
+    """Map of url path -> html of the whole site.
+
+    Book pages are only needed by the full extractor, without them large synthetic catalogs fit in memory.
+    """
+    books = [dict(
+        name=name, slug=_slug(name, i), price=10 + (i * 37 % 4000) / 100,
+        rating=RATINGS[i % 5], in_stock=i % 7 != 0, category=i % n_categories
+    ) for i, name in enumerate(names)]
+    categories = [(f"Category {c}", f"catalogue/category/books/category-{c}_{c + 2}/") for c in range(n_categories)]
+
+    pages = dict()
+    nav = "\n".join(
+        f'<li>\n<a href="{link}index.html">\n                            \n                                {name}\n'
+        f'                            \n                        </a>\n</li>'
+        for name, link in categories)
+    pages["/index.html"] = _layout(
+        f'<ul class="nav nav-list">\n<li>\n<a href="catalogue/category/books_1/index.html">\n Books\n</a>\n<ul>\n{nav}\n</ul>\n</li>\n</ul>',
+        _product_pods(books[:BOOKS_PER_PAGE], "catalogue/"))
+
+    books_of = [[] for _ in categories]
+    for book in books:
+        books_of[book["category"]].append(book)
+
+    for c, (name, link) in enumerate(categories):
+        category_books = books_of[c]
+        n_pages = max(1, -(-len(category_books) // BOOKS_PER_PAGE))
+        for p in range(n_pages):
+            page_name = "index.html" if p == 0 else f"page-{p + 1}.html"
+            pager = ""
+            if n_pages > 1:
+                pager = f'<ul class="pager">\n<li class="current">\n Page {p + 1} of {n_pages}\n</li>\n'
+                if p > 0:
+                    pager += f'<li class="previous"><a href="{"index.html" if p == 1 else f"page-{p}.html"}">previous</a></li>\n'
+                if p < n_pages - 1:
+                    pager += f'<li class="next"><a href="page-{p + 2}.html">next</a></li>\n'
+                pager += '</ul>'
+            page_books = category_books[p * BOOKS_PER_PAGE:(p + 1) * BOOKS_PER_PAGE]
+            pages["/" + link + page_name] = _layout(f'<div class="page-header"><h1>{name}</h1></div>',
+                                                    _product_pods(page_books, "../../../") + pager)
+
+    for book in books if book_pages else []:
+        pages[f"/catalogue/{book['slug']}/index.html"] = _book_page(book, categories[book["category"]][0])
+    return pages
+
+
+def _layout(side: str, content: str):
+    return (f'<!DOCTYPE html>\n<html lang="en-us">\n<head><meta charset="utf-8"><title>All products | Books to Scrape</title></head>\n'
+            f'<body id="default" class="default">\n<div class="container-fluid page">\n<div class="page_inner">\n'
+            f'<div class="row">\n<aside class="sidebar col-sm-4 col-md-3">\n<div class="side_categories">\n{side}\n</div>\n</aside>\n'
+            f'<div class="col-sm-8 col-md-9">\n<section>\n<div>\n<ol class="row">\n{content}\n</ol>\n</div>\n</section>\n</div>\n'
+            f'</div>\n</div>\n</div>\n</body>\n</html>\n')
+
+
+def _product_pods(books: list, prefix: str):
+    return "\n".join(
+        f'<li class="col-xs-6 col-sm-4 col-md-3 col-lg-3">\n<article class="product_pod">\n'
+        f'<div class="image_container">\n<a href="{prefix}{b["slug"]}/index.html"><img src="media/cache/{b["slug"]}.jpg" '
+        f'alt="{escape(b["name"])}" class="thumbnail"></a>\n</div>\n'
+        f'<p class="star-rating {b["rating"]}">\n<i class="icon-star"></i>\n</p>\n'
+        f'<h3><a href="{prefix}{b["slug"]}/index.html" title="{escape(b["name"])}">{escape(b["name"][:20])}...</a></h3>\n'
+        f'<div class="product_price">\n<p class="price_color">£{b["price"]:.2f}</p>\n'
+        f'<p class="instock availability">\n    <i class="icon-ok"></i>\n    \n        {"In stock" if b["in_stock"] else "Out of stock"}\n    \n</p>\n'
+        f'<form><button type="submit" class="btn btn-primary btn-block">Add to basket</button></form>\n</div>\n'
+        f'</article>\n</li>'
+        for b in books)
+
+
+def _book_page(book: dict, category: str):
+    upc = hashlib.md5(book["slug"].encode()).hexdigest()[:16]
+    available = f'In stock ({book["category"] + 1} available)' if book["in_stock"] else "Out of stock (0 available)"
+    rows = [("UPC", upc), ("Product Type", "Books"), ("Price (excl. tax)", f'£{book["price"]:.2f}'),
+            ("Price (incl. tax)", f'£{book["price"]:.2f}'), ("Tax", "£0.00"),
+            ("Availability", available), ("Number of reviews", "0")]
+    table = "\n".join(f"<tr>\n<th>{k}</th><td>{v}</td>\n</tr>" for k, v in rows)
+    return _layout(
+        f'<ul class="breadcrumb"><li>{escape(category)}</li></ul>',
+        f'<article class="product_page">\n<div class="row">\n<div class="col-sm-6 product_main">\n'
+        f'<h1>{escape(book["name"])}</h1>\n<p class="price_color">£{book["price"]:.2f}</p>\n'
+        f'<p class="star-rating {book["rating"]}">\n<i class="icon-star"></i>\n</p>\n</div>\n</div>\n'
+        f'<div id="product_description" class="sub-header">\n    <h2>Product Description</h2>\n</div>\n'
+        f'<p>{escape(book["name"])} is a book in the {escape(category)} category. ...more</p>\n'
+        f'<div class="sub-header">\n    <h2>Product Information</h2>\n</div>\n'
+        f'<table class="table table-striped">\n{table}\n</table>\n</article>')
+
+
+def load_saved_pages(pages_dir: str):
+    """Map of url path -> html for a directory with saved pages of the real site."""
+    pages = dict()
+    for root, _, files in os.walk(pages_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            with open(path, encoding="utf-8") as fp:
+                pages["/" + os.path.relpath(path, pages_dir).replace(os.sep, "/")] = fp.read()
+    return pages
+
+
+class SiteServer():
+    """Serves pages from memory on a local port, in a background thread."""
+
+    def __init__(self, pages: dict, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.set_pages(pages)
+        self.set_faults()
+        self.requests_served = 0
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                site.requests_served += 1
+                path = self.path.split("?")[0].replace("//", "/")
+                if site.fault_paths is None or path.startswith(tuple(site.fault_paths)):
+                    time.sleep(site.latency)
+                    if site.random.random() < site.error_rate:
+                        self.send_response(site.error_status)
+                        if site.retry_after is not None:
+                            self.send_header("Retry-After", str(site.retry_after))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                body = site.pages.get(path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def set_pages(self, pages: dict):
+        self.pages = {path: html.encode("utf-8") for path, html in pages.items()}
+
+    def set_faults(self, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                   paths: list = None, seed: int = 0, retry_after: float = None):
+        """Delay responses by latency seconds and answer error_status (with Retry-After if given) to a share
+        of requests, only for paths starting with one of paths (all if None)."""
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fault_paths = paths
+        self.random = random.Random(seed)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve an offline copy of books.toscrape.com.")
+    parser.add_argument("--n-books", type=int, default=None)
+    parser.add_argument("--pages-dir", type=str, default=None)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    pages = load_saved_pages(args.pages_dir) if args.pages_dir else render_site(get_book_names(n_books=args.n_books))
+    with SiteServer(pages, port=args.port) as server:
+        server.set_faults(args.latency, args.error_rate)
+        print(f"Serving {len(pages)} pages on {server.base_url}/index.html")
+        server.thread.join()
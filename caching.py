@@ -0,0 +1,89 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache():
+    """Thread-safe cache with least recently used eviction, bounded by number of entries and/or bytes.
+
+    Sizes of values are estimated with size_of (ndarray.nbytes for arrays, sys.getsizeof otherwise).
+    If ttl (seconds) is given, entries older than ttl are dropped when they are read.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, size_of=None, ttl: float = None) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of or self.default_size_of
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.current_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default_size_of(value):
+        return getattr(value, "nbytes", None) or sys.getsizeof(value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, size, expires_ts = self._data[key]
+                if expires_ts is None or time.monotonic() < expires_ts:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.current_bytes -= size
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        with self._lock:
+            if key in self._data:
+                self.current_bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size, time.monotonic() + self.ttl if self.ttl is not None else None)
+            self.current_bytes += size
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, self)
+        if value is self:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def _evict(self):
+        while self._data and ((self.max_entries is not None and len(self._data) > self.max_entries)
+                              or (self.max_bytes is not None and self.current_bytes > self.max_bytes)):
+            _, (_, size, _) = self._data.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,124 @@
+import sys
+import time
+import numpy as np
+from match_books import BookVectorIndex, InvertedIndex
+
+
+class BookTable():
+    """Books in columns, the book id is the row, shared by the vector and token indexes of a snapshot.
+
+    Names are interned strings, prices are integer cents, availability and ratings are small typed arrays,
+    so a book costs a few bytes besides its name, and filters and sorts are vectorized.
+    """
+
+    FILTERS = ("min_price", "max_price", "min_rating", "available")
+    SORT_KEYS = ("price", "rating")
+
+    def __init__(self, names: list, price_cents: np.ndarray, available: np.ndarray, ratings: np.ndarray) -> None:
+        self.names = names
+        self.price_cents = np.asarray(price_cents, dtype=np.int32)
+        self.available = np.asarray(available, dtype=bool)
+        self.ratings = np.asarray(ratings, dtype=np.int8)
+
+    @classmethod
+    def from_rows(cls, rows: list):
+        """Table of rows [name, price, avail, rating] as returned by parsers."""
+        return cls([sys.intern(row[0]) for row in rows],
+                   np.round(np.array([row[1] for row in rows], dtype=np.float64) * 100),
+                   [row[2] for row in rows], [row[3] for row in rows])
+
+    @classmethod
+    def concat(cls, tables: list):
+        if not tables:
+            return cls.from_rows([])
+        return cls([name for table in tables for name in table.names],
+                   np.concatenate([table.price_cents for table in tables]),
+                   np.concatenate([table.available for table in tables]),
+                   np.concatenate([table.ratings for table in tables]))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def prices(self):
+        return self.price_cents / 100
+
+    @property
+    def nbytes(self):
+        return self.price_cents.nbytes + self.available.nbytes + self.ratings.nbytes + 8 * len(self.names)
+
+    def row(self, book_id: int):
+        """[name, price, avail, rating] of a book, a new list on every call."""
+        return [self.names[book_id], int(self.price_cents[book_id]) / 100, bool(self.available[book_id]), int(self.ratings[book_id])]
+
+    def to_rows(self):
+        return [self.row(book_id) for book_id in range(len(self))]
+
+    def mask(self, min_price: float = None, max_price: float = None, min_rating: int = None, available: bool = None):
+        """Boolean mask by book id of books passing all given filters."""
+        mask = np.ones(len(self), dtype=bool)
+        if min_price is not None:
+            mask &= self.price_cents >= round(min_price * 100)
+        if max_price is not None:
+            mask &= self.price_cents <= round(max_price * 100)
+        if min_rating is not None:
+            mask &= self.ratings >= min_rating
+        if available is not None:
+            mask &= self.available == available
+        return mask
+
+    def argsort(self, book_ids: np.ndarray, by: str = "price", descending: bool = False):
+        """Positions in book_ids that sort the books by price or rating, ties keep the given order."""
+        values = {"price": self.price_cents, "rating": self.ratings}[by][np.asarray(book_ids, dtype=np.int64)].astype(np.int64)
+        return np.argsort(-values if descending else values, kind="stable")
+
+
+class CatalogPage():
+    """Books parsed from one category page, reused while the page does not change."""
+
+    def __init__(self, books: list, next_url: str = None) -> None:
+        # Rows [name, price, avail, rating] are stored as a table
+        self.books = books if isinstance(books, BookTable) else BookTable.from_rows(books)
+        self.next_url = next_url
+        # Embedded and preprocessed only once, after the page is parsed
+        self.vectors = None
+        self.names_clean = None
+
+
+class CatalogSnapshot():
+    """State of the whole catalog at one crawl, never mutated after creation.
+
+    Readers keep a reference to the snapshot they started with, refresh swaps in a new one as a whole.
+    Book ids stay the same across snapshots while the page of the book does not change (page_ids), so the next
+    snapshot only updates the indexes for changed pages. Rows of books of removed pages are kept but not alive.
+    """
+
+    def __init__(self, books: BookTable, first_page: np.ndarray, book_index: BookVectorIndex, token_index: InvertedIndex,
+                 version: int, refresh_duration: float, created_ts: float = None, alive: np.ndarray = None,
+                 page_ids: dict = None) -> None:
+        self.books = books
+        # Books found on the first page of their category
+        self.first_page = first_page
+        self.alive = alive if alive is not None else np.ones(len(books), dtype=bool)
+        self.n_alive = int(self.alive.sum())
+        # Page -> ids of its books
+        self.page_ids = page_ids if page_ids is not None else dict()
+        self.book_index = book_index
+        self.token_index = token_index
+        self.version = version
+        self.refresh_duration = refresh_duration
+        self.created_ts = created_ts or time.time()
+
+    def __len__(self):
+        return self.n_alive
+
+    def age(self):
+        return time.time() - self.created_ts
+
+    def get_metrics(self):
+        return {
+            "version": self.version,
+            "books": len(self),
+            "age_s": self.age(),
+            "refresh_duration_s": self.refresh_duration,
+        }
@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+from catalog import CatalogPage
+from crawler import PageState
+
+
+class CrawlStore():
+    """SQLite file with the last crawl: parsed pages with book vectors, page validators and crawl timestamps.
+
+    Loaded at startup, so a restart serves the stored catalog and refreshes it incrementally instead of
+    crawling the whole site. Written after each refresh in a single transaction.
+    Book vectors and preprocessed names are only loaded if they were stored with the same fingerprint
+    (of the embedding model, see Matcher.fingerprint), otherwise books are embedded again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY, position INTEGER, next_url TEXT, books TEXT, names_clean TEXT, vectors BLOB, dim INTEGER);
+        CREATE TABLE IF NOT EXISTS page_states (
+            url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, fetched_ts REAL);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path: str, fingerprint: str = None) -> None:
+        self.path = path
+        self.fingerprint = fingerprint
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, category_urls: list, pages: dict, page_states: dict, crawl_ts: float = None, pages_changed: bool = True):
+        """Replace the stored crawl; if pages did not change only validators and timestamps are written."""
+        crawl_ts = crawl_ts or time.time()
+        with self._connect() as conn:
+            if pages_changed:
+                conn.execute("DELETE FROM pages")
+                conn.executemany("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                    (url, position, page.next_url, json.dumps(page.books.to_rows()),
+                     json.dumps(page.names_clean) if page.names_clean is not None else None,
+                     page.vectors.astype(np.float32).tobytes() if page.vectors is not None else None,
+                     page.vectors.shape[1] if page.vectors is not None else None)
+                    for position, (url, page) in enumerate(pages.items())])
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('category_urls', ?)", (json.dumps(category_urls), ))
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (self.fingerprint, ))
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('pages_ts', ?)", (repr(crawl_ts), ))
+
+            conn.execute("DELETE FROM page_states")
+            conn.executemany("INSERT INTO page_states VALUES (?, ?, ?, ?, ?)", [
+                (url, state.etag, state.last_modified, state.content_hash, state.fetched_ts)
+                for url, state in page_states.items()])
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('crawl_ts', ?)", (repr(crawl_ts), ))
+
+    def get_timestamps(self):
+        """(time of the last crawl that changed pages, time of the last crawl), None if nothing is stored."""
+        with self._connect() as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('pages_ts', 'crawl_ts')").fetchall())
+        if "crawl_ts" not in meta:
+            return None
+        return float(meta.get("pages_ts", 0.0)), float(meta["crawl_ts"])
+
+    def load(self):
+        """(category_urls, pages, page_states, crawl_ts) of the stored crawl, None if nothing is stored."""
+        with self._connect() as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            if "category_urls" not in meta:
+                return None
+
+            # Vectors of another model are not comparable with query vectors
+            same_model = meta.get("fingerprint") == self.fingerprint
+            pages = dict()
+            for url, next_url, books, names_clean, vectors, dim in conn.execute(
+                    "SELECT url, next_url, books, names_clean, vectors, dim FROM pages ORDER BY position"):
+                page = CatalogPage(json.loads(books), next_url)
+                if vectors is not None and same_model:
+                    page.vectors = np.frombuffer(vectors, dtype=np.float32).reshape(-1, dim)
+                    page.names_clean = json.loads(names_clean)
+                pages[url] = page
+
+            page_states = dict()
+            for url, etag, last_modified, content_hash, fetched_ts in conn.execute("SELECT * FROM page_states"):
+                page_states[url] = PageState(etag, last_modified, content_hash)
+                page_states[url].fetched_ts = fetched_ts
+
+        return json.loads(meta["category_urls"]), pages, page_states, float(meta.get("crawl_ts", 0.0))
@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import itertools
+import threading
+import time
+from urllib.parse import urlsplit
+import aiohttp
+from metrics import BYTES_DOWNLOADED, CRAWL_FAILURES, PAGES_FETCHED, timed
+
+
+class PageState():
+    """Validators of the last successful download of a page."""
+
+    def __init__(self, etag: str, last_modified: str, content_hash: str) -> None:
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.fetched_ts = time.time()
+
+
+class CrawlFailure():
+    """A page that was not crawled.
+
+    reason is one of http_status (4xx), server_error (5xx or 429 after retries), timeout, connection,
+    circuit_open (host was failing, not requested), deadline (crawl time ran out) or parse.
+    """
+
+    def __init__(self, url: str, reason: str, status: int = None, error: str = None, attempts: int = 0) -> None:
+        self.url = url
+        self.reason = reason
+        self.status = status
+        self.error = error
+        self.attempts = attempts
+        self.ts = time.time()
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class TokenBucket():
+    """Rate limit of rate requests per second on average, with bursts of up to burst requests."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returns seconds to wait before using it (tokens are reserved in order of calls)."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_ts) * self.rate)
+            self.updated_ts = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker():
+    """Stops requests to a host after failure_threshold failed requests in a row.
+
+    While open, requests fail without being sent. After reset_timeout seconds one trial request is let through
+    (half-open) per reset_timeout: a success closes the circuit, a failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_ts = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_ts is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_ts < self.reset_timeout else "half_open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_ts is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_ts < self.reset_timeout:
+                return False
+            # Trial request, the next one only after another reset_timeout (also if this one never finishes)
+            self.opened_ts = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_ts = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_ts = time.monotonic()
+
+
+class AsyncCrawler():
+    """Crawls pages concurrently in a single process with a pool of keep-alive connections.
+
+    Pages are taken from a priority frontier by a bounded number of workers, shallow pages first
+    (start urls, then the pages they link to, ...), so first pages of categories come before deep pagination.
+    For every downloaded page the callback `on_page(url, markup, changed)` is called, it returns urls to follow
+    (e.g. next pages). For every page that was not crawled `on_failure(url)` is called if given, it can also return
+    urls to follow (e.g. from the last good version of the page); failures are listed in `failures`.
+    Pages are requested with conditional GETs (ETag/Last-Modified); if the page did not change since
+    the previous crawl, changed is False and markup is None (304) or the same content as before.
+    If `is_cached(url)` is given, only pages it accepts (the caller still has their content) are conditional.
+
+    Politeness: requests to every host are limited to rate_limit per second (token bucket, None for no limit)
+    and stopped by a circuit breaker after repeated failures. A crawl stops after max_crawl_time seconds,
+    pages not crawled by then are reported as failures, so callers get partial results.
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_per_host: int = 8, retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 10.0, rate_limit: float = 20.0, burst: int = 20,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, max_crawl_time: float = None) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_crawl_time = max_crawl_time
+        self.failures = []
+        self.page_states = dict()
+        # Rate limit and circuit breaker of every host, kept across crawls
+        self.buckets = dict()
+        self.breakers = dict()
+        self.stats = self._new_stats()
+
+    @staticmethod
+    def _new_stats():
+        return {"fetched": 0, "not_modified": 0, "unchanged": 0, "changed": 0, "bytes": 0, "failed": 0}
+
+    @property
+    def failed_urls(self):
+        return [failure.url for failure in self.failures]
+
+    def get_circuit_states(self):
+        return {host: breaker.state for host, breaker in self.breakers.items()}
+
+    def run(self, start_urls: list, on_page, on_failure=None, is_cached=None):
+        """Crawl synchronously, returns the number of fetched pages."""
+        return asyncio.run(self.crawl(start_urls, on_page, on_failure, is_cached))
+
+    async def crawl(self, start_urls: list, on_page, on_failure=None, is_cached=None):
+        self.failures = []
+        self.stats = self._new_stats()
+        # (depth, order of discovery, url)
+        frontier, order = asyncio.PriorityQueue(), itertools.count()
+        seen, done = set(start_urls), set()
+        for url in start_urls:
+            frontier.put_nowait((0, next(order), url))
+
+        async with self.session() as session:
+            async def worker():
+                while True:
+                    depth, _, url = await frontier.get()
+                    try:
+                        try:
+                            conditional = is_cached is None or is_cached(url)
+                            markup, changed = await self.fetch(session, url, conditional)
+                            follow = on_page(url, markup, changed) if markup is not None or not changed else None
+                        except Exception as e:
+                            print("Impossible to process the page.", url, e)
+                            self._fail(url, "parse", error=e)
+                            markup, changed = None, True
+                        if markup is None and changed:
+                            follow = self._recover(url, on_failure)
+
+                        done.add(url)
+                        for next_url in follow or []:
+                            if next_url not in seen:
+                                seen.add(next_url)
+                                frontier.put_nowait((depth + 1, next(order), next_url))
+                    finally:
+                        frontier.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+            try:
+                await asyncio.wait_for(frontier.join(), self.max_crawl_time)
+            except asyncio.TimeoutError:
+                print("Crawl time is over, pages left:", len(seen) - len(done))
+            finally:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        # Pages in flight or still in the frontier when the time ran out
+        pending = [url for url in seen if url not in done]
+        while pending:
+            url = pending.pop()
+            self._fail(url, "deadline")
+            for next_url in self._recover(url, on_failure) or []:
+                if next_url not in seen:
+                    seen.add(next_url)
+                    pending.append(next_url)
+        return self.stats["fetched"]
+
+    @staticmethod
+    def _recover(url: str, on_failure):
+        if on_failure is None:
+            return None
+        try:
+            return on_failure(url)
+        except Exception as e:
+            print("Impossible to recover the page.", url, e)
+            return None
+
+    def _fail(self, url: str, reason: str, status: int = None, error=None, attempts: int = 0):
+        self.failures.append(CrawlFailure(url, reason, status, str(error) if error is not None else None, attempts))
+        self.stats["failed"] += 1
+        CRAWL_FAILURES.inc(reason=reason)
+        return None, True
+
+    def _host(self, url: str):
+        """(token bucket or None, circuit breaker) of the host of the url."""
+        host = urlsplit(url).netloc
+        if host not in self.breakers:
+            self.buckets[host] = TokenBucket(self.rate_limit, self.burst) if self.rate_limit else None
+            self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.buckets[host], self.breakers[host]
+
+    def session(self) -> aiohttp.ClientSession:
+        """Session with a pool of keep-alive connections, bounded in total and per host."""
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_per_host)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, conditional: bool = True):
+        """Get (markup, changed) of the page, (None, True) on failure (added to failures).
+
+        Without conditional, validators of the previous crawl are dropped, the whole page is downloaded.
+
+        Waits for the rate limit of the host before every request and fails fast while its circuit is open.
+        Retries with exponential backoff on connection errors, 429 and 5xx responses (at least Retry-After).
+        """
+        if url == '':
+            raise TypeError("URL must be non-empty.")
+        with timed("fetch"):
+            return await self._fetch(session, url, conditional)
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str, conditional: bool = True):
+        if not conditional:
+            # A 304 would leave the caller without content
+            self.page_states.pop(url, None)
+        state = self.page_states.get(url)
+        headers = dict()
+        if state is not None and state.etag:
+            headers["If-None-Match"] = state.etag
+        if state is not None and state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+
+        bucket, breaker = self._host(url)
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                return self._fail(url, "circuit_open", attempts=attempt)
+            if bucket is not None:
+                await bucket.acquire()
+
+            retry_after = 0.0
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and state is not None:
+                        breaker.record_success()
+                        self.stats["not_modified"] += 1
+                        PAGES_FETCHED.inc(status="not_modified")
+                        state.fetched_ts = time.time()
+                        return None, False
+
+                    if response.status < 500 and response.status != 429:
+                        # The host answered, 4xx will not change on retry
+                        breaker.record_success()
+                        if response.status >= 400:
+                            print("Not valid url to ectract the data.", url, response.status)
+                            PAGES_FETCHED.inc(status="failed")
+                            return self._fail(url, "http_status", response.status, f"HTTP {response.status}", attempt + 1)
+                        body = await response.read()
+                        PAGES_FETCHED.inc(status="ok")
+                        BYTES_DOWNLOADED.inc(len(body))
+                        return body.decode("utf-8"), self._update_state(url, response, body)
+                    reason, status, error = "server_error", response.status, f"HTTP {response.status}"
+                    retry_after = self._retry_after(response)
+            except asyncio.TimeoutError as e:
+                reason, status, error = "timeout", None, e
+            except aiohttp.ClientError as e:
+                reason, status, error = "connection", None, e
+
+            breaker.record_failure()
+            if attempt < self.retries:
+                await asyncio.sleep(max(self.backoff * 2 ** attempt, retry_after))
+
+        print("Not valid url to ectract the data.", url, error)
+        PAGES_FETCHED.inc(status="failed")
+        return self._fail(url, reason, status, error, self.retries + 1)
+
+    def _retry_after(self, response: aiohttp.ClientResponse):
+        """Seconds asked by the host in Retry-After, at most the request timeout."""
+        try:
+            return min(float(response.headers.get("Retry-After", 0)), self.timeout)
+        except ValueError:
+            # HTTP date, the backoff is used
+            return 0.0
+
+    def _update_state(self, url: str, response: aiohttp.ClientResponse, body: bytes):
+        """Store validators of the page, returns if the content changed since the last crawl."""
+        content_hash = hashlib.blake2b(body, digest_size=16).hexdigest()
+        previous = self.page_states.get(url)
+        self.page_states[url] = PageState(response.headers.get("ETag"), response.headers.get("Last-Modified"), content_hash)
+
+        changed = previous is None or previous.content_hash != content_hash
+        self.stats["fetched"] += 1
+        self.stats["bytes"] += len(body)
+        self.stats["changed" if changed else "unchanged"] += 1
+        return changed
@@ -0,0 +1,65 @@
+import json
+import os
+import pickle
+import numpy as np
+
+
+class EmbeddingStore():
+    """Book name -> vector, stored as rows of one float32 matrix.
+
+    On disk: `<path>.npy` with the matrix, memory-mapped on load so worker processes share its pages,
+    and `<path>.names.json` with book names in the order of rows.
+    """
+
+    def __init__(self, names: list, vectors: np.ndarray) -> None:
+        assert len(names) == vectors.shape[0], "Number of names and vectors differ"
+        self.names = names
+        self.vectors = vectors
+        self.index = {name: row for row, name in enumerate(names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name: str):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def get(self, name: str, default=None):
+        row = self.index.get(name)
+        return default if row is None else self.vectors[row]
+
+    def rows(self, names: list):
+        """Row of every name, -1 for unknown names."""
+        return np.array([self.index.get(name, -1) for name in names], dtype=np.int64)
+
+    @classmethod
+    def from_dict(cls, embeddings: dict, dim: int = None):
+        names = list(embeddings)
+        dim = dim if dim is not None else (len(embeddings[names[0]]) if names else 0)
+        vectors = np.array([embeddings[name] for name in names], dtype=np.float32).reshape(len(names), dim)
+        return cls(names, vectors)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r"):
+        with open(path + ".names.json", encoding="utf-8") as fp:
+            names = json.load(fp)
+        return cls(names, np.load(path + ".npy", mmap_mode=mmap_mode))
+
+    @staticmethod
+    def exists(path: str):
+        return os.path.exists(path + ".npy") and os.path.exists(path + ".names.json")
+
+    def save(self, path: str):
+        np.save(path + ".npy", np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(path + ".names.json", "w", encoding="utf-8") as fp:
+            json.dump(self.names, fp, ensure_ascii=False)
+
+
+def convert_pickle(path_in: str = "embeddings/w2v_avg_vectors.p", path_out: str = "embeddings/w2v_avg_vectors"):
+    """Convert a pickled dict name -> vector to the store format."""
+    with open(path_in, 'rb') as fp:
+        store = EmbeddingStore.from_dict(pickle.load(fp))
+    store.save(path_out)
+    return store
@@ -1,35 +1,303 @@
+import copy
+import hashlib
+import json
+import os
 import pickle
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import stopwords 
-from nltk.tokenize import word_tokenize
-import pandas as pd
+import threading
 import numpy as np
-from numpy import dot
 from numpy.linalg import norm
-from gensim.models import Word2Vec
+from caching import LRUCache
+from embedding_store import EmbeddingStore
+from metrics import BOOKS_SCORED
+from subword import SubwordVectors
 import warnings
 
 warnings.filterwarnings(action = 'ignore')
 
+# NLTK and gensim are imported on first use, importing this module (and starting a worker) stays fast
+
+
+class BookVectorIndex():
+    """Exact search over a contiguous matrix of pre-normalized book vectors with a parallel array of book ids."""
+
+    def __init__(self, vectors: np.ndarray, book_ids: np.ndarray) -> None:
+        self.book_ids = np.asarray(book_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        # Vector size from the last axis, also for an empty catalog
+        self.matrix = self.normalize(vectors.reshape(len(self.book_ids), vectors.shape[-1]))
+        self._row_of = {book_id: row for row, book_id in enumerate(self.book_ids.tolist())}
+
+    def __len__(self):
+        return self.book_ids.shape[0]
+
+    @staticmethod
+    def normalize(vectors: np.ndarray):
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Zero vectors (no words in vocabulary) stay zero, so they never pass the threshold
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def top_k(book_ids: np.ndarray, scores: np.ndarray, k: int, threshold: float):
+        """Best k (book_ids, scores) with |score| > threshold, the same rule as in Matcher.get_matches."""
+        masked = np.where(np.abs(scores) > threshold, scores, -np.inf)
+        n_top = min(k, int(np.isfinite(masked).sum()))
+        if n_top == 0:
+            return book_ids[:0], scores[:0]
+
+        top = np.argpartition(-masked, n_top - 1)[:n_top] if n_top < len(masked) else np.arange(len(masked))
+        top = top[np.argsort(-masked[top], kind="stable")][:n_top]
+        return book_ids[top], scores[top]
+
+    def scores(self, query_vectors: np.ndarray):
+        """Cosine similarities of shape (n_queries, n_books)."""
+        return self.normalize(query_vectors) @ self.matrix.T
+
+    def score_books(self, query_vector: np.ndarray, book_ids: np.ndarray):
+        """Cosine similarities of one query with the given books only."""
+        rows = np.array([self._row_of[book_id] for book_id in np.asarray(book_ids).tolist()], dtype=np.int64)
+        return self.matrix[rows] @ self.normalize(query_vector)[0]
+
+    def search(self, query_vectors: np.ndarray, k: int = 10, threshold: float = 0.65, mask: np.ndarray = None):
+        """Top-k matching books per query, list of (book_ids, similarities) tuples.
+
+        Optional boolean mask indexed by book id restricts the search.
+        """
+        allowed = mask[self.book_ids] if mask is not None else None
+        BOOKS_SCORED.inc(len(query_vectors) * len(self.book_ids))
+        results = []
+        for scores in self.scores(query_vectors):
+            if allowed is not None:
+                scores = np.where(allowed, scores, 0.0)
+            results.append(self.top_k(self.book_ids, scores, k, threshold))
+        return results
+
+    def copy(self):
+        """Copy that can be updated without changing this index (arrays are replaced by updates, not modified)."""
+        index = copy.copy(self)
+        index._row_of = dict(self._row_of)
+        return index
+
+    def updated(self, removed_ids: np.ndarray, book_ids: np.ndarray, vectors: np.ndarray):
+        """New index without removed_ids and with the given books, this index is not modified."""
+        index = self.copy()
+        index.remove(removed_ids)
+        if len(book_ids):
+            index.add(book_ids, vectors)
+        return index
+
+    def add(self, book_ids: np.ndarray, vectors: np.ndarray):
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        self.remove(book_ids)
+        self._row_of.update({book_id: len(self.book_ids) + i for i, book_id in enumerate(book_ids.tolist())})
+        self.book_ids = np.concatenate([self.book_ids, book_ids])
+        self.matrix = np.vstack([self.matrix, self.normalize(vectors).reshape(len(book_ids), -1)])
+
+    def remove(self, book_ids: np.ndarray):
+        rows = [row for book_id in np.asarray(book_ids).tolist() if (row := self._row_of.get(book_id)) is not None]
+        if rows:
+            keep = np.ones(len(self.book_ids), dtype=bool)
+            keep[rows] = False
+            self.book_ids, self.matrix = self.book_ids[keep], self.matrix[keep]
+            self._row_of = {book_id: row for row, book_id in enumerate(self.book_ids.tolist())}
+
+
+class InvertedIndex():
+    """Preprocessed (stemmed) token -> ids of books whose names contain it."""
 
-class Matcher():
     def __init__(self) -> None:
-        self.emb_model = self.get_or_train_fast_text()
-        self.data_embeddings = self.get_data_embeddings()
+        self.postings = dict()
+        self.book_tokens = dict()
+
+    def __len__(self):
+        return len(self.book_tokens)
+
+    def add(self, book_id: int, tokens: list):
+        self.remove(book_id)
+        self.book_tokens[book_id] = tokens
+        for token in set(tokens):
+            self.postings.setdefault(token, set()).add(book_id)
+
+    def remove(self, book_id: int):
+        for token in set(self.book_tokens.pop(book_id, [])):
+            posting = self.postings[token]
+            posting.discard(book_id)
+            if not posting:
+                del self.postings[token]
+
+    def updated(self, removed_ids, added: list):
+        """New index without removed_ids and with added (book_id, tokens), this index is not modified.
+
+        Postings are shared with this index, only postings of tokens of changed books are copied.
+        """
+        index = InvertedIndex()
+        index.postings = dict(self.postings)
+        index.book_tokens = dict(self.book_tokens)
+        changed = dict()
+
+        def posting(token):
+            if token not in changed:
+                changed[token] = set(index.postings.get(token, ()))
+            return changed[token]
+
+        for book_id in np.asarray(removed_ids).tolist():
+            for token in set(index.book_tokens.pop(book_id, [])):
+                posting(token).discard(book_id)
+        for book_id, tokens in added:
+            index.book_tokens[book_id] = tokens
+            for token in set(tokens):
+                posting(token).add(book_id)
+
+        for token, book_ids in changed.items():
+            if book_ids:
+                index.postings[token] = book_ids
+            else:
+                index.postings.pop(token, None)
+        return index
+
+    def search(self, query_clean: list):
+        """Sorted ids of books containing all query tokens, intersecting the shortest posting lists first."""
+        if len(query_clean) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        postings = sorted((self.postings.get(token, set()) for token in set(query_clean)), key=len)
+        book_ids = set(postings[0])
+        for posting in postings[1:]:
+            book_ids &= posting
+            if not book_ids:
+                break
+        return np.array(sorted(book_ids), dtype=np.int64)
+
+
+class Matcher():
+    """Query preprocessing and embeddings.
+
+    Word vectors, book embeddings and NLTK are loaded on first use (or by warm_up), so creating a matcher is cheap.
+    Words out of the word2vec vocabulary are embedded by their character n-grams if use_subwords is set.
+    """
+
+    def __init__(self, cache_entries: int = 10000, vector_cache_bytes: int = 32 * 2**20,
+                 word_vectors_path: str = "embeddings/word2vec.kv", model_path: str = "embeddings/word2vec.model",
+                 data_embeddings_path: str = "embeddings/w2v_avg_vectors",
+                 subword_vectors_path: str = "embeddings/subword_vectors", use_subwords: bool = True) -> None:
+        self.word_vectors_path = word_vectors_path
+        self.model_path = model_path
+        self.data_embeddings_path = data_embeddings_path
+        self.subword_vectors_path = subword_vectors_path
+        self.use_subwords = use_subwords
+        self._word_vectors = None
+        self._subword_vectors = None
+        self._data_embeddings = None
+        self._lemmatizer = None
+        self._stemmer = None
+        # Reentrant, a loader can use another lazily loaded attribute
+        self._load_lock = threading.RLock()
+        self.similarity_threshold = 0.65
+
+        # Memoized preprocessing, query traffic is skewed towards few titles
+        self.token_cache = LRUCache(max_entries=cache_entries)
+        self.query_cache = LRUCache(max_entries=cache_entries)
+        self.vector_cache = LRUCache(max_bytes=vector_cache_bytes)
+
+    def _load_once(self, attr: str, load):
+        if getattr(self, attr) is None:
+            with self._load_lock:
+                if getattr(self, attr) is None:
+                    setattr(self, attr, load())
+        return getattr(self, attr)
+
+    @property
+    def word_vectors(self):
+        return self._load_once("_word_vectors", lambda: self.load_word_vectors(self.word_vectors_path, self.model_path))
+
+    @property
+    def subword_vectors(self) -> SubwordVectors:
+        if not self.use_subwords:
+            return None
+        word_vectors = self.word_vectors
+        return self._load_once("_subword_vectors", lambda: self.load_subword_vectors(self.subword_vectors_path, word_vectors))
+
+    @property
+    def data_embeddings(self) -> EmbeddingStore:
+        return self._load_once("_data_embeddings", lambda: self.get_data_embeddings(self.data_embeddings_path))
+
+    @property
+    def lemmatizer(self):
+        from nltk.stem import WordNetLemmatizer
+        return self._load_once("_lemmatizer", WordNetLemmatizer)
+
+    @property
+    def stemmer(self):
+        from nltk.stem import PorterStemmer
+        return self._load_once("_stemmer", PorterStemmer)
+
+    def is_loaded(self):
+        loaded = (self._word_vectors, self._data_embeddings, self._lemmatizer, self._stemmer)
+        return all(value is not None for value in loaded) and (not self.use_subwords or self._subword_vectors is not None)
+
+    def fingerprint(self):
+        """Id of the files and settings book vectors are computed from, without loading them.
+
+        Book vectors stored elsewhere (crawl store) are only valid for the same fingerprint.
+        """
+        paths = [self.word_vectors_path, self.word_vectors_path + ".vectors.npy", self.model_path,
+                 self.data_embeddings_path + ".npy", self.data_embeddings_path + ".p"]
+        if self.use_subwords:
+            paths.append(self.subword_vectors_path + ".npy")
+        # Contents, not modification times: a fresh clone or deploy of the same files keeps the stored vectors
+        digest = hashlib.blake2b(json.dumps(self.use_subwords).encode(), digest_size=16)
+        for path in paths:
+            if not os.path.exists(path):
+                digest.update(b"missing")
+                continue
+            with open(path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(chunk)
+            digest.update(b"end")
+        return digest.hexdigest()
+
+    def warm_up(self):
+        """Load everything used by queries, so the first query is not slow."""
+        self.word_vectors
+        self.subword_vectors
+        self.data_embeddings
+        # Imports NLTK and loads its corpora
+        self.preprocess_name("warm up")
 
     @staticmethod
     def get_or_train_fast_text(path_in: str = "data/clean_last_update_small.csv", model_path:str = "embeddings/word2vec.model"):
+        from gensim.models import Word2Vec
         model = Word2Vec.load(model_path)
         return model
+
+    @staticmethod
+    def load_word_vectors(path_in: str = "embeddings/word2vec.kv", model_path: str = "embeddings/word2vec.model"):
+        """Only the word vectors of the model, memory-mapped if converted (utils/convert_embeddings.py --word-vectors).
+
+        Falls back to the vectors of the full trainable model.
+        """
+        from gensim.models import KeyedVectors
+        if os.path.exists(path_in):
+            return KeyedVectors.load(path_in, mmap="r")
+        return Matcher.get_or_train_fast_text(model_path=model_path).wv
+
+    @staticmethod
+    def load_subword_vectors(path_in: str = "embeddings/subword_vectors", word_vectors=None) -> SubwordVectors:
+        """Memory-mapped n-gram vectors (utils/convert_embeddings.py --subwords), built from word_vectors if not stored."""
+        if SubwordVectors.exists(path_in):
+            return SubwordVectors.load(path_in)
+        return SubwordVectors.from_word_vectors(word_vectors)
     
     @staticmethod
-    def get_data_embeddings(path_in: str = "embeddings/w2v_avg_vectors.p"):
-        with open(path_in, 'rb') as fp:
+    def get_data_embeddings(path_in: str = "embeddings/w2v_avg_vectors") -> EmbeddingStore:
+        # Memory-mapped store, pickled dict is converted on load
+        if EmbeddingStore.exists(path_in):
+            return EmbeddingStore.load(path_in)
+
+        with open(path_in + ".p", 'rb') as fp:
             data = pickle.load(fp)
-        return data
+        return EmbeddingStore.from_dict(data)
     
     @staticmethod
     def jaccard_distance(set1:set, set2:set):
@@ -46,18 +314,75 @@ class Matcher():
         return np.linalg.norm(a - b)
     
     def preprocess_query(self, query: str): 
-        lemmatizer = WordNetLemmatizer()
-        stemmer = PorterStemmer()
+        return list(self.query_cache.get_or_compute(query, lambda: tuple(self._preprocess_query(query))))
+
+    def preprocess_name(self, name: str):
+        """Same as preprocess_query for book names, they do not go through the query cache."""
+        return self._preprocess_query(name)
+
+    def _preprocess_query(self, query: str):
+        from nltk.tokenize import word_tokenize
         tokens = word_tokenize(query)
-        return [stemmer.stem(lemmatizer.lemmatize(word)) for word in tokens if word.isalpha() or len(tokens) < 2]
-    
+        return [self.preprocess_token(word) for word in tokens if word.isalpha() or len(tokens) < 2]
+
+    def preprocess_token(self, word: str):
+        return self.token_cache.get_or_compute(word, lambda: self.stemmer.stem(self.lemmatizer.lemmatize(word)))
+
     def get_embedding_vector(self, query):
-        try:
-            return np.mean([self.emb_model.wv[word] for word in query], axis=0)
-        except KeyError as e:
-            # print("Words are not in w2v traning corpus:" + str(query))
-            return np.zeros((100, ))
+        return self.vector_cache.get_or_compute(tuple(query), lambda: self._get_embedding_vector(query))
+
+    def _get_embedding_vector(self, query):
+        word_vectors, subword_vectors = self.word_vectors, self.subword_vectors
+        vectors = []
+        for word in query:
+            if word in word_vectors.key_to_index:
+                vectors.append(word_vectors[word])
+            elif subword_vectors is not None and (vec := subword_vectors.get(word)) is not None:
+                vectors.append(vec)
+        # Words that can not be embedded are skipped, only a query without any known word gets a zero vector
+        vec = np.mean(vectors, axis=0) if vectors else np.zeros((word_vectors.vector_size, ))
+        # Shared between callers through the cache
+        vec.flags.writeable = False
+        return vec
+
+    def get_cache_stats(self):
+        return {
+            "token": self.token_cache.get_stats(),
+            "query": self.query_cache.get_stats(),
+            "vector": self.vector_cache.get_stats(),
+        }
+
+    def get_embedding_vectors(self, queries: list):
+        """Stack embeddings of several preprocessed queries, to be scored at once."""
+        return np.array([self.get_embedding_vector(query) for query in queries], dtype=np.float32)\
+            .reshape(len(queries), self.word_vectors.vector_size)
+
+    def get_book_vector(self, name: str):
+        vec = self.data_embeddings.get(name)
+        return vec if vec is not None and vec.size > 0 else self._get_embedding_vector(self.preprocess_name(name))
+
+    def get_book_vectors(self, names: list):
+        # Known names are gathered from the store at once, others are embedded
+        rows = self.data_embeddings.rows(names)
+        vectors = np.zeros((len(names), self.word_vectors.vector_size), dtype=np.float32)
+        vectors[rows >= 0] = self.data_embeddings.vectors[rows[rows >= 0]]
+        for i in np.flatnonzero(rows < 0):
+            vectors[i] = self.get_book_vector(names[i])
+        return vectors
+
+    def build_book_index(self, names: list, book_ids=None) -> BookVectorIndex:
+        """Stack vectors of all book names into a single matrix for batched search."""
+        book_ids = np.arange(len(names)) if book_ids is None else book_ids
+        return BookVectorIndex(self.get_book_vectors(names), book_ids)
         
+    def build_token_index(self, names_clean: list, book_ids=None) -> InvertedIndex:
+        """Index of preprocessed book names for simple (inclusion) matching."""
+        book_ids = range(len(names_clean)) if book_ids is None else book_ids
+        index = InvertedIndex()
+        for book_id, tokens in zip(book_ids, names_clean):
+            index.add(book_id, tokens)
+        return index
+
     def get_matches(self, query_clean, candidate, use_simple_matching) -> bool|list:
         if use_simple_matching:
             candidate_clean = self.preprocess_query(candidate)
@@ -65,7 +390,7 @@ class Matcher():
                 if " ".join(query_clean) in candidate_clean else False
 
         else:
-            candidate_clean = r if (r := self.data_embeddings.get(candidate)).size > 0 else self.get_embedding_vector(self.preprocess_query(candidate))
+            candidate_clean = self.get_book_vector(candidate)
             sim = self.cosine_similarity(query_clean, candidate_clean)
-            return [sim] if sim > 0.65 or sim < -0.65 else False
+            return [sim] if abs(sim) > self.similarity_threshold else False
     
\ No newline at end of file
@@ -0,0 +1,139 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cached query to a full crawl
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class Counter():
+    """Monotonic counter, one value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram():
+    """Cumulative bucket counts, sum and count of observations, one set per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket", dict(labels, le=repr(bound)), bucket_count))
+                samples.append((self.name + "_bucket", dict(labels, le="+Inf"), count))
+                samples.append((self.name + "_sum", labels, total))
+                samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class MetricsRegistry():
+    """Metrics of the process, rendered in the Prometheus text format.
+
+    Collectors are called on render and return (name, kind, help, [(labels, value)]) for values that are
+    kept elsewhere, e.g. cache statistics.
+    """
+
+    def __init__(self) -> None:
+        self.metrics = dict()
+        self.collectors = []
+
+    def counter(self, name: str, help: str):
+        return self.metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += [self._format_sample(*sample) for sample in metric.samples()]
+        for collector in self.collectors:
+            for name, kind, help, values in collector():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [self._format_sample(name, labels, value) for labels, value in values]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_sample(name: str, labels: dict, value: float):
+        if not labels:
+            return f"{name} {float(value)!r}"
+        label_str = ",".join(f'{key}="{str(val)}"' for key, val in labels.items())
+        return f"{name}{{{label_str}}} {float(value)!r}"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("book_search_stage_seconds", "Latency of crawl, parse, match and sort stages.")
+PAGES_FETCHED = REGISTRY.counter("book_search_pages_fetched_total", "Pages requested from the shop by response.")
+CRAWL_FAILURES = REGISTRY.counter("book_search_crawl_failures_total", "Pages not crawled by reason.")
+BYTES_DOWNLOADED = REGISTRY.counter("book_search_bytes_downloaded_total", "Bytes of page bodies downloaded.")
+BOOKS_SCORED = REGISTRY.counter("book_search_books_scored_total", "Book vectors scored against queries.")
+QUERIES = REGISTRY.counter("book_search_queries_total", "Queries answered.")
+
+# Stages of the current request, set only while a request is profiled
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of the block in the stage histogram and in the profile trace if one is active."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+@contextmanager
+def profile():
+    """Collect (stage, seconds) of all timed blocks run by this thread (and its asyncio tasks) in the block."""
+    trace = []
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
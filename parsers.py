@@ -0,0 +1,157 @@
+from enum import Enum
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+class Rating(Enum):
+    Zero = 0
+    One = 1
+    Two = 2
+    Three = 3
+    Four = 4
+    Five = 5
+
+
+class BeautifulSoupParser():
+    """Parses pages of the book shop with BeautifulSoup and html.parser, slow but has no extra dependencies."""
+
+    name = "html.parser"
+
+    @staticmethod
+    def _soup(markup: str):
+        # Imported on first use, the lxml parser does not need it
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(markup=markup, features="html.parser")
+
+    def parse_category_links(self, markup: str):
+        """Category name -> relative link, from the side menu of the main page."""
+        soup = self._soup(markup)
+        all_generes = soup.find('ul', attrs={"class": "nav nav-list"}).findAll("a", href=True)
+        category_link = dict()
+
+        # Skip books, then all categories
+        for genre in all_generes[1:]:
+            category_link[genre.text.strip().lower()] = genre['href']
+        return category_link
+
+    def parse_category_page(self, markup: str):
+        """List of (book url, [name, price, avail, rating]) and relative link to the next page or None."""
+        soup = self._soup(markup)
+        books = [book for book_class in soup.findAll('article', attrs={"class": "product_pod"})
+                 if (book := self._get_book_info(book_class)) is not None]
+        return books, self._next_page_url(soup)
+
+    def parse_book_page(self, markup: str):
+        """Name, description, rating name and rows (key, value) of the information table of a book page."""
+        soup = self._soup(markup)
+        book_class = soup.find('article', attrs={"class": "product_page"})
+        name = book_class.find("div", attrs={"class": "col-sm-6 product_main"}).find("h1").text
+        description_elem = book_class.find("div", attrs={"class": "sub-header", "id": "product_description"})
+        description = description_elem.next_element.next_element.next_element.next_element.next_element.next_element.text if description_elem else ""
+        rating = book_class.find("p", attrs={"class": "star-rating"}).attrs.get("class")[1]
+
+        table = book_class.find('table', attrs={"class": "table table-striped"})
+        rows = [(th.text, td.text) for th, td in zip(table.findAll("th"), table.findAll("td"))]
+        return name, description, rating, rows
+
+    @staticmethod
+    def _get_book_info(book_class: "BeautifulSoup"):
+        try:
+            url = "catalogue/" + book_class.find('a', href=True).attrs.get("href").replace("../", "")
+            name = book_class.find('img', attrs={"class": "thumbnail"}).attrs.get("alt").lower()
+            price = float(book_class.find('p', attrs={"class": "price_color"}).string[1:])
+            avail = True if book_class.find('p', attrs={"instock availability"}).text.strip() == "In stock" else False
+            rating = Rating[book_class.find("p", attrs={"class": "star-rating"}).attrs.get("class")[1]].value
+            return url, [name, price, avail, rating]
+        except Exception as e:
+            print("Impossible to fetch book data from the main page.", e)
+
+    @staticmethod
+    def _next_page_url(soup: "BeautifulSoup"):
+        buttons = soup.find('ul', attrs={"class": "pager"})
+        if buttons:
+            buttons = buttons.findAll("a", href=True)
+            next = [button["href"] for button in buttons if button.text == "next"]
+            return next[0] if len(next) > 0 else None
+        return None
+
+
+class LxmlParser(BeautifulSoupParser):
+    """Fast path on top of lxml, product pods and pager links are collected in a single pass over the tree."""
+
+    name = "lxml"
+
+    def parse_category_links(self, markup: str):
+        tree = lxml.html.fromstring(markup)
+        category_link = dict()
+        for ul in tree.iter("ul"):
+            if ul.get("class") == "nav nav-list":
+                # Skip books, then all categories
+                for genre in [a for a in ul.iter("a") if a.get("href") is not None][1:]:
+                    category_link[genre.text_content().strip().lower()] = genre.get("href")
+                break
+        return category_link
+
+    def parse_category_page(self, markup: str):
+        tree = lxml.html.fromstring(markup)
+        books, next_url = [], None
+        for el in tree.iter("article", "ul"):
+            if el.tag == "article" and el.get("class") == "product_pod":
+                if (book := self._get_book_info(el)) is not None:
+                    books.append(book)
+            elif el.tag == "ul" and el.get("class") == "pager":
+                next_url = next((a.get("href") for a in el.iter("a") if a.text == "next" and a.get("href")), None)
+        return books, next_url
+
+    def parse_book_page(self, markup: str):
+        tree = lxml.html.fromstring(markup)
+        book_class = next(el for el in tree.iter("article") if el.get("class") == "product_page")
+
+        name, description, rating, rows = None, "", None, []
+        for el in book_class.iter("div", "p", "tr"):
+            css_class = el.get("class")
+            if el.tag == "div" and css_class == "col-sm-6 product_main":
+                name = next(el.iter("h1")).text_content()
+            elif el.tag == "div" and el.get("id") == "product_description":
+                description = el.getnext().text_content() if el.getnext() is not None else ""
+            elif el.tag == "p" and rating is None and css_class and css_class.startswith("star-rating"):
+                rating = css_class.split()[1]
+            elif el.tag == "tr":
+                rows.append((next(el.iter("th")).text_content(), next(el.iter("td")).text_content()))
+        return name, description, rating, rows
+
+    @staticmethod
+    def _get_book_info(book_class):
+        try:
+            url, name, price, avail, rating = None, None, None, None, None
+            for el in book_class.iter("a", "img", "p"):
+                css_class = el.get("class")
+                if el.tag == "a" and url is None and el.get("href") is not None:
+                    url = "catalogue/" + el.get("href").replace("../", "")
+                elif el.tag == "img" and css_class == "thumbnail":
+                    name = el.get("alt").lower()
+                elif el.tag == "p" and css_class == "price_color":
+                    price = float(el.text[1:])
+                elif el.tag == "p" and css_class == "instock availability":
+                    avail = el.text_content().strip() == "In stock"
+                elif el.tag == "p" and css_class and css_class.startswith("star-rating"):
+                    rating = Rating[css_class.split()[1]].value
+            if url is None or name is None or price is None or avail is None or rating is None:
+                raise ValueError("missing fields of the product")
+            return url, [name, price, avail, rating]
+        except Exception as e:
+            print("Impossible to fetch book data from the main page.", e)
+
+
+PARSERS = {BeautifulSoupParser.name: BeautifulSoupParser, LxmlParser.name: LxmlParser}
+
+
+def get_parser(name: str = LxmlParser.name):
+    """Parser by name, falls back to BeautifulSoup if lxml is not installed."""
+    if name == LxmlParser.name and lxml is None:
+        print("lxml is not installed, falling back to html.parser.")
+        name = BeautifulSoupParser.name
+    return PARSERS[name]()
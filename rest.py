@@ -1,8 +1,11 @@
-from flask import Flask, json
+import threading
+from flask import Flask, Response, json, request, stream_with_context
 from search_data import BookSearchScraper
 from search_data import get_result_dict
+from metrics import REGISTRY, profile
 
-BOOK_SCRAPER = BookSearchScraper(cache_update_ts=3)
+BOOK_SCRAPER = BookSearchScraper(cache_update_ts=3, store_path="data/crawl_cache.sqlite")
+REGISTRY.add_collector(lambda: BOOK_SCRAPER.collect_metrics())
 
 api = Flask("book_search")
 
@@ -15,20 +18,93 @@ def get_help():
     help = "Example simple query: " + "http://127.0.0.1:5000/simple/alice" + "<br/>" + \
         "Example query with arguments " + \
         "search_all_pages (true/false) - search not only first page: " +\
-        "http://127.0.0.1:5000/args/sharp%20obj/true"
+        "http://127.0.0.1:5000/args/sharp%20obj/true" + "<br/>" + \
+        "Batch of queries: POST http://127.0.0.1:5000/search/batch with JSON " + \
+        '{"queries": ["alice", "sharp obj"], "search_all_pages": true, "extended_info": true, "stream": false}, ' + \
+        "stream returns one JSON line per crawled category on a cold cache, then the final results, " + \
+        'optional "filters": {"min_price", "max_price", "min_rating", "available"} and "sort_by": "price"/"rating"/"-price"/"-rating"' + "<br/>" + \
+        "Add ?profile=1 to a query to get time spent in every stage, " + \
+        "metrics in Prometheus format: http://127.0.0.1:5000/metrics"
     return help
 
+def search_response(search):
+    """JSON of the search result dict, with time spent in every stage under "profile" if ?profile=1."""
+    if request.args.get("profile", "").lower() not in ("1", "true"):
+        # Results keep their order (by relevance or sort_by), flask sorts keys by default
+        return json.dumps(search(), sort_keys=False)
+    with profile() as trace:
+        res = search()
+    # Total time and number of calls per stage, in the order stages were first entered
+    res["profile"] = dict()
+    for stage, seconds in trace:
+        stats = res["profile"].setdefault(stage, {"ms": 0.0, "calls": 0})
+        stats["ms"] += seconds * 1000
+        stats["calls"] += 1
+    return json.dumps(res, sort_keys=False)
+
 @api.route("/simple/<query>", methods=["GET"])
 def get_book(query: str):
-    res_books = BOOK_SCRAPER.collect_search_data(query, search_all_pages=True, extended_info=True)
-    print(get_result_dict(query, res_books))
-    return json.dumps(get_result_dict(query, res_books))
+    return search_response(lambda: get_result_dict(
+        query, BOOK_SCRAPER.collect_search_data(query, search_all_pages=True, extended_info=True)))
 
 @api.route("/args/<query>/<search_all_pages>", methods=["GET"])
 def get_book_with_args(query: str, search_all_pages: str):
     search_all_pages = bool(search_all_pages)
-    res_books = BOOK_SCRAPER.collect_search_data(query, search_all_pages=search_all_pages, extended_info=True)
-    return json.dumps(get_result_dict(query, res_books))
+    return search_response(lambda: get_result_dict(
+        query, BOOK_SCRAPER.collect_search_data(query, search_all_pages=search_all_pages, extended_info=True)))
+
+@api.route("/search/batch", methods=["POST"])
+def get_books_batch():
+    body = request.get_json(force=True, silent=True) or dict()
+    queries = body.get("queries")
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return json.dumps({"error": "'queries' must be a list of strings"}), 400
+    search_all_pages = bool(body.get("search_all_pages", False))
+    extended_info = bool(body.get("extended_info", True))
+    filters, sort_by = body.get("filters") or None, body.get("sort_by")
+    try:
+        BOOK_SCRAPER.check_search_options(filters, sort_by)
+    except (ValueError, TypeError) as e:
+        return json.dumps({"error": str(e)}), 400
+
+    if not body.get("stream", False):
+        def search():
+            res_books = BOOK_SCRAPER.collect_search_data_batch(queries, extended_info, search_all_pages, filters, sort_by)
+            return {"results": [get_result_dict(query, res) for query, res in zip(queries, res_books)]}
+        return search_response(search)
+
+    # Newline delimited JSON, partial results per category while the catalog is crawled
+    def generate():
+        for category, res_books in BOOK_SCRAPER.iter_search_data_batch(queries, extended_info, search_all_pages, filters, sort_by):
+            yield json.dumps({"category": category, "final": category is None,
+                              "results": [get_result_dict(query, res) for query, res in zip(queries, res_books)]},
+                             sort_keys=False) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@api.route("/health", methods=["GET"])
+def get_health():
+    return json.dumps({"alive": True})
+
+@api.route("/ready", methods=["GET"])
+def get_ready():
+    # Not ready (503) until models are loaded and a catalog is available, e.g. for load balancers
+    ready = BOOK_SCRAPER.is_ready()
+    return json.dumps({"ready": ready, "snapshot_version": BOOK_SCRAPER.snapshot.version if BOOK_SCRAPER.snapshot else 0}), \
+        200 if ready else 503
+
+@api.route("/snapshot", methods=["GET"])
+def get_snapshot_metrics():
+    return json.dumps(BOOK_SCRAPER.get_snapshot_metrics())
+
+@api.route("/caches", methods=["GET"])
+def get_cache_stats():
+    return json.dumps(BOOK_SCRAPER.get_cache_stats())
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
+    # Load models and crawl before the first request arrives, later refreshes run in background when the snapshot is stale
+    threading.Thread(target=BOOK_SCRAPER.warm_up, daemon=True).start()
     api.run()
@@ -5,4 +5,4 @@ pip install --upgrade pip
 mkdir -p embeddings
 
 # Run actual script
-python rest.py
+python serve.py
@@ -1,23 +1,22 @@
+import math
+import os
+import queue
 import time
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
-from enum import Enum
-import pandas as pd
-from joblib import Parallel, delayed
-from match_books import Matcher
+import threading
+from urllib.parse import urljoin
+import numpy as np
+from catalog import BookTable, CatalogPage, CatalogSnapshot
+from crawl_store import CrawlStore
+from crawler import AsyncCrawler
+from ann_index import IVFIndex, VECTOR_INDEXES
+from caching import LRUCache
+from match_books import BookVectorIndex, Matcher
+from metrics import QUERIES, timed
+from parsers import Rating, get_parser
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
-class Rating(Enum):
-    Zero = 0
-    One = 1
-    Two = 2
-    Three = 3
-    Four = 4
-    Five = 5
-
-
 class BookSearchScraper():
     expected_cols = [ 
         'url', 'name', 'rating', 'category', 'price', 'availability'
@@ -27,128 +26,553 @@ class BookSearchScraper():
     BOOK_SHOP_BASE_URL = "http://books.toscrape.com"
 
 
-    def __init__(self, cache_update_ts: float = 0.0) -> None:
+    def __init__(self, cache_update_ts: float = 0.0, max_concurrency: int = 16, parser: str = "lxml",
+                 vector_index: str = "exact", n_probe: int = 8, store_path: str = None,
+                 result_cache_entries: int = 10000, result_cache_ttl: float = 300.0,
+                 rate_limit: float = 20.0, crawl_timeout: float = 60.0) -> None:
         self.matcher = Matcher()
+        # Polite to the shop: at most rate_limit requests per second, a refresh ends after crawl_timeout seconds
+        # with the pages crawled so far (and the last good version of the others)
+        self.crawler = AsyncCrawler(max_concurrency=max_concurrency, rate_limit=rate_limit, max_crawl_time=crawl_timeout)
+        self.parser = get_parser(parser)
         # self.categories_cache = [] can be added if data does not fit in memory
-        self.data_cache = []
-        self.cache_ts = 0.0
+        self.snapshot = None
         self.cache_update_ts = cache_update_ts
         self.use_embeddings = True
         self.best_k_matches = 10
+        # Exact or approximate ("ivf") embedding search, n_probe trades recall for latency
+        self.vector_index = vector_index
+        self.n_probe = n_probe
+        # Results by (query tokens, extended_info, search_all_pages, snapshot version), popular queries are skewed
+        self.result_cache = LRUCache(max_entries=result_cache_entries, ttl=result_cache_ttl)
 
-    def collect_search_data(self, query: str, extended_info: bool = False, search_all_pages: bool = False):
-        # Preprocess query
-        query = self.matcher.preprocess_query(query)
+        # Stale-while-revalidate: one refresh at a time, readers keep the last good snapshot
+        self.refresh_count = 0
+        self.refresh_errors = 0
+        self._refresh_lock = threading.Lock()
+        self._stop_refresh = threading.Event()
 
-        # Check if cached
-        if len(self.data_cache) > 0 and time.time() - self.cache_ts < self.cache_update_ts:
-            final_res = []
+        # Parsed pages of the last crawl by url, for incremental refresh
+        self._category_urls = []
+        self._pages = dict()
+        # Called with (category url, its pages) when a category is crawled, used for streaming on a cold cache
+        self._category_listeners = []
 
-            search_query_emb = self.matcher.get_embedding_vector(query)
-            final_res = [[m] + book for book in self.data_cache \
-                         if (m := self.matcher.get_matches(search_query_emb, book[0], not self.use_embeddings)) \
-                         or (m := self.matcher.get_matches(query, book[0], True))]
+        # Last crawl persisted on disk, a restart does not need a full crawl
+        self.crawl_store = CrawlStore(store_path, self.matcher.fingerprint()) if store_path else None
+        # Pages version of the store that the snapshot was built from or saved to
+        self._store_pages_ts = 0.0
+        # Refreshes shared between processes (share_refresh): lock file, held by the refreshing process
+        self._refresh_lock_path = None
+        self._refresher_fd = None
+        self._next_store_check_ts = 0.0
+        self._load_store()
 
-        else:
-            # Get main URL
-            soup_main = self._get_data_from_url()
-
-            # Get categories and get books for each in parallel
-            categories = self._get_all_category_links(soup_main)
-            combined_res = Parallel(n_jobs=len(categories))\
-                (delayed(self._search_in_category)\
-                (link, query, extended_info, search_all_pages) for link in categories.values())
-            
-            # Merge results
-            final_res, self.data_cache = [], []
-            for vals in combined_res:
-                final_res.extend([m] + b for b, m in zip(vals[0], vals[1]))
-                self.data_cache.extend(vals[2])
-
-            self.cache_ts=time.time()
-        
-        # Get k best, if matched by name then prioritize
-        if len(final_res) > self.best_k_matches:
-            final_res = sorted(final_res, key=lambda x: x[0][0] \
-                               if isinstance(x[0][0], float) else 1, reverse=True)[0:self.best_k_matches]
-
-        return final_res
-
-    def _search_in_category(self, link: str, query: str, extended_info: bool = False, search_all_pages: bool = False):
-        full_url = self.BOOK_SHOP_BASE_URL + "/" + link
-        soup_category = self._get_data_from_url(full_url)
-        res_category, res_match, res_cache = self._get_items_from_page_markup(soup_category, query, extended_info, search_all_pages)
-        return res_category, res_match, res_cache
-
-    def _get_data_from_url(self, url: str = BOOK_SHOP_URL) -> BeautifulSoup:
-        """"Extract data from the given url."""
-        if url == '':
-            raise TypeError("URL must be non-empty.")
-            
-        try: 
-            page = urlopen(url)
-            markup = page.read().decode("utf-8")
-            soup = BeautifulSoup(markup=markup, features="html.parser")
-            return soup
+    def collect_search_data(self, query: str, extended_info: bool = False, search_all_pages: bool = False,
+                            filters: dict = None, sort_by: str = None):
+        return self.collect_search_data_batch([query], extended_info, search_all_pages, filters, sort_by)[0]
+
+    def collect_search_data_batch(self, queries: list, extended_info: bool = False, search_all_pages: bool = False,
+                                  filters: dict = None, sort_by: str = None):
+        """Results of every query; filters (BookTable.mask arguments) restrict the books,
+        sort_by ("price", "rating", "-" prefix for descending) orders the top matches instead of relevance.
+        """
+        self.check_search_options(filters, sort_by)
+        QUERIES.inc(len(queries))
+        with timed("search"):
+            # Preprocess queries
+            with timed("preprocess"):
+                queries = [self.matcher.preprocess_query(query) for query in queries]
+            return self._search_cached(self.get_snapshot(), queries, extended_info, search_all_pages, filters, sort_by)
+
+    @staticmethod
+    def check_search_options(filters: dict = None, sort_by: str = None):
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError("Filters must be a dict.")
+        unknown = set(filters or dict()) - set(BookTable.FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters {sorted(unknown)}, expected some of {list(BookTable.FILTERS)}.")
+        if not all(isinstance(value, (int, float)) or value is None for value in (filters or dict()).values()):
+            raise ValueError("Filter values must be numbers or booleans.")
+        # JSON accepts NaN and Infinity, prices are compared in cents
+        if not all(value is None or math.isfinite(value * 100) for value in (filters or dict()).values()):
+            raise ValueError("Filter values must be finite.")
+        if sort_by is not None and (not isinstance(sort_by, str) or sort_by.lstrip("-") not in BookTable.SORT_KEYS):
+            raise ValueError(f"Unknown sort key {sort_by}, expected one of {list(BookTable.SORT_KEYS)}.")
+
+    def _search_cached(self, snapshot: CatalogSnapshot, queries_clean: list, extended_info: bool, search_all_pages: bool,
+                       filters: dict = None, sort_by: str = None):
+        """_search_snapshot through the result cache, only queries that are not cached are searched."""
+        options = (extended_info, search_all_pages, tuple(sorted((filters or dict()).items())), sort_by)
+        keys = [(tuple(query), ) + options + (snapshot.version, ) for query in queries_clean]
+        results = [self.result_cache.get(key) for key in keys]
+        missing = [i for i, res in enumerate(results) if res is None]
+        if missing:
+            found = self._search_snapshot(snapshot, [queries_clean[i] for i in missing], extended_info, search_all_pages,
+                                          filters, sort_by)
+            for i, res in zip(missing, found):
+                self.result_cache.put(keys[i], res)
+                results[i] = res
+        # Callers get their own rows, cached results stay unchanged (simple matches are lists of query tokens)
+        return [[[list(row[0]) if isinstance(row[0], list) else row[0]] + row[1:] for row in res] for res in results]
+
+    def iter_search_data_batch(self, queries: list, extended_info: bool = False, search_all_pages: bool = False,
+                               filters: dict = None, sort_by: str = None):
+        """Yield (category url, results per query) as categories are crawled on a cold cache.
+
+        The last item has category None and results over the whole catalog. If a snapshot is
+        already available, only the last item is yielded.
+        """
+        self.check_search_options(filters, sort_by)
+        QUERIES.inc(len(queries))
+        # Until the results over the whole catalog, like collect_search_data_batch on a cold cache
+        with timed("search"):
+            with timed("preprocess"):
+                queries_clean = [self.matcher.preprocess_query(query) for query in queries]
+            seen_refresh, snapshot = self.refresh_count, self.snapshot
+            if snapshot is not None:
+                yield None, self._search_cached(self.get_snapshot(), queries_clean, extended_info, search_all_pages, filters, sort_by)
+                return
+
+            events = queue.Queue()
+            listener = lambda category, pages: events.put((category, list(pages)))
+            self._category_listeners.append(listener)
+            try:
+                def refresh():
+                    snapshot = None
+                    try:
+                        snapshot = self.refresh_snapshot(seen_refresh)
+                    finally:
+                        events.put((None, snapshot))
+
+                threading.Thread(target=refresh, daemon=True).start()
+                while True:
+                    category, payload = events.get()
+                    if category is None:
+                        yield None, self._search_cached(payload, queries_clean, extended_info, search_all_pages, filters, sort_by) \
+                            if payload is not None else [[] for _ in queries]
+                        return
+
+                    # Books of one category, searched as a small snapshot of their own; the pages belong to the
+                    # running refresh, so they are embedded here without being modified
+                    partial = self._build_snapshot([(page, i == 0) for i, page in enumerate(payload)], None, 0.0, "exact",
+                                                   update_pages=False)
+                    yield category, self._search_snapshot(partial, queries_clean, extended_info, search_all_pages, filters, sort_by)
+            finally:
+                self._category_listeners.remove(listener)
+
+    def warm_up(self):
+        """Load the models and refresh the catalog, the scraper is ready afterwards."""
+        self.matcher.warm_up()
+        self.refresh_snapshot()
+
+    def is_ready(self):
+        """A catalog is available and queries do not need to load models."""
+        return self.snapshot is not None and self.matcher.is_loaded()
+
+    def get_snapshot(self) -> CatalogSnapshot:
+        """Current snapshot, stale one triggers a refresh in background but is still served."""
+        seen_refresh, snapshot = self.refresh_count, self.snapshot
+
+        # Nothing to serve yet, wait for the first crawl
+        if snapshot is None:
+            return self.refresh_snapshot(seen_refresh)
+
+        if snapshot.age() >= self.cache_update_ts and not self._refresh_lock.locked():
+            threading.Thread(target=self.refresh_snapshot, args=(seen_refresh, ), daemon=True).start()
+        return snapshot
+
+    def start_background_refresh(self):
+        """Refresh the snapshot every cache_update_ts seconds on a daemon thread."""
+        self._stop_refresh.clear()
+        thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stop_background_refresh(self):
+        self._stop_refresh.set()
+
+    def _refresh_loop(self):
+        while not self._stop_refresh.is_set():
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.age() >= self.cache_update_ts:
+                self.refresh_snapshot()
+                snapshot = self.snapshot
+            self._stop_refresh.wait(max(0.1, self.cache_update_ts - snapshot.age()) if snapshot else self.cache_update_ts)
+
+    def share_refresh(self, lock_path: str = None):
+        """Share refreshes with the other processes using the same crawl store (e.g. forked server workers).
+
+        Only the process holding the lock file crawls the shop, on a background thread, so the shop sees one
+        crawler with one rate limit. The other processes load the catalog from the crawl store when it is newer
+        than their snapshot. If the crawling process exits, its lock is released and the next process that finds
+        its snapshot stale takes over.
+        """
+        if self.crawl_store is None:
+            raise ValueError("Shared refreshes need a crawl store.")
+        self._refresh_lock_path = lock_path or self.crawl_store.path + ".lock"
+        self._try_lead_refresh()
+
+    def _try_lead_refresh(self):
+        """Take the refresh lock without waiting, returns if this process refreshes the catalog."""
+        if self._refresh_lock_path is None or self._refresher_fd is not None:
+            return True
+        import fcntl
+        fd = os.open(self._refresh_lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # Released by the OS when the process exits
+        self._refresher_fd = fd
+        self.start_background_refresh()
+        return True
+
+    def refresh_snapshot(self, seen_refresh: int = None) -> CatalogSnapshot:
+        """Crawl the catalog and atomically swap in a new snapshot.
+
+        If seen_refresh (value of refresh_count) is given and another refresh finished in the meantime,
+        its result is returned instead of crawling again. With shared refreshes, a process that does not hold
+        the refresh lock loads the stored catalog instead of crawling.
+        """
+        with self._refresh_lock:
+            current = self.snapshot
+            if seen_refresh is not None and self.refresh_count != seen_refresh:
+                return current
+            if not self._try_lead_refresh():
+                return self._follow_store(current)
+
+            start = time.time()
+            try:
+                with timed("crawl"):
+                    pages, changed = self._crawl_catalog()
+                if len(pages) == 0 and current is not None:
+                    raise ValueError("no pages found, keeping the last snapshot")
+                # All pages are from the last crawl, the shop is down: the snapshot must keep aging
+                if current is not None and self.crawler.stats["fetched"] + self.crawler.stats["not_modified"] == 0:
+                    raise ValueError("no page could be crawled, keeping the last snapshot")
+            except Exception as e:
+                print("Impossible to refresh the catalog.", e)
+                self.refresh_errors += 1
+                if current is not None:
+                    return current
+                pages, changed = [], True
+
+            if changed or current is None:
+                with timed("build_snapshot"):
+                    self.snapshot = self._build_snapshot(pages, current, time.time() - start)
+                # Results of older versions can not be hit anymore
+                self.result_cache.clear()
+            else:
+                # Same content, only mark the snapshot as fresh
+                self.snapshot = CatalogSnapshot(current.books, current.first_page, current.book_index, current.token_index,
+                                                current.version, time.time() - start, alive=current.alive, page_ids=current.page_ids)
+            self.refresh_count += 1
+            self._save_store(changed)
+            return self.snapshot
+
+    def _load_store(self):
+        if self.crawl_store is None:
+            return
+        try:
+            stored = self.crawl_store.load()
         except Exception as e:
-            print("Not valid url to ectract the data.", e)
-    
-    def _get_book_info_from_page(self, book_class: BeautifulSoup, extended_info: bool = False):
+            print("Impossible to load the stored crawl.", e)
+            return
+        if stored is None:
+            return
+
+        self._category_urls, self._pages, self.crawler.page_states, crawl_ts = stored
+        snapshot = self._build_snapshot(self._ordered_pages(), None, 0.0)
+        # Age of the stored crawl decides when it is refreshed
+        snapshot.created_ts = crawl_ts
+        self.snapshot = snapshot
+        self._store_pages_ts = crawl_ts
+
+    def _save_store(self, pages_changed: bool = True):
+        if self.crawl_store is None:
+            return
         try:
-            url = "catalogue/" + book_class.find('a', href=True).attrs.get("href").replace("../", "")
-            name = book_class.find('img', attrs={"class": "thumbnail"}).attrs.get("alt").lower()
-            price = float(book_class.find('p', attrs={"class": "price_color"}).string[1:])
-
-            if extended_info:
-                avail = True if book_class.find('p', attrs={"instock availability"}).text.strip() == "In stock" else False
-                rating = Rating[book_class.find("p", attrs={"class": "star-rating"}).attrs.get("class")[1]].value
-                return url, [name, price, avail, rating]
+            self.crawl_store.save(self._category_urls, self._pages, self.crawler.page_states, self.snapshot.created_ts, pages_changed)
+            if pages_changed:
+                self._store_pages_ts = self.snapshot.created_ts
         except Exception as e:
-            print("Impossible to fetch book data from the main page.", e)
-        return url, [name, price]
-
-    def _get_items_from_page_markup(self, soup: BeautifulSoup, search_query: str, category_url: str, extended_info: bool = False, search_all_pages: bool = False):
-        matches, result, cache = [], [], []
-        for book_class in soup.findAll('article', attrs={"class": "product_pod"}):
-            _, new_book = self._get_book_info_from_page(book_class, extended_info)
-            cache.append(new_book)
-
-            search_query_emb = self.matcher.get_embedding_vector(search_query)
-            match_res = self.matcher.get_matches(search_query_emb, new_book[0], not self.use_embeddings)
-            
-            if not match_res:
-                match_res = self.matcher.get_matches(search_query, new_book[0], True)
-
-            if match_res:
-                result.append(new_book)
-                matches.append(match_res)
-
-        # Get data recursively from next pages
-        if search_all_pages:
-            next_page = self._next_page_url(soup)
-            if next_page:
-                next_soap = self._get_data_from_url(category_url.replace("index.html", "") + "/" + next_page)
-                self._get_items_from_page_markup(next_soap, search_query, category_url)
-        
-        return result, matches, cache
-
-    def _get_all_category_links(self, soup: BeautifulSoup):
-        all_generes = soup.find('ul', attrs={"class": "nav nav-list"}).findAll("a", href=True)
-        category_link = dict()
-        
-        # Skip books, then all categories
-        for genre in all_generes[1:]:
-            category_link[genre.text.strip().lower()] = genre['href']
-        return category_link
-
-    def _next_page_url(self, soup: BeautifulSoup):
-        buttons = soup.find('ul', attrs={"class": "pager"})
-        if buttons:
-            buttons = buttons.findAll("a", href=True)
-            next = [button["href"] for button in buttons if button.text == "next"]
-            return next[0] if len(next) > 0 else False
-        return False
-    
+            print("Impossible to store the crawl.", e)
+
+    def _follow_store(self, current: CatalogSnapshot):
+        """Snapshot of the catalog stored by the refreshing process, current one if the store is not newer."""
+        # Stale snapshots trigger this on every request, the store is read at most once a second
+        if current is not None and time.time() < self._next_store_check_ts:
+            return current
+        self._next_store_check_ts = time.time() + 1.0
+        try:
+            timestamps = self.crawl_store.get_timestamps()
+            if timestamps is None or (current is not None and timestamps[1] <= current.created_ts):
+                return current
+            pages_ts, crawl_ts = timestamps
+            if current is not None and pages_ts <= self._store_pages_ts:
+                # Same pages, only mark the snapshot as fresh
+                self.snapshot = CatalogSnapshot(current.books, current.first_page, current.book_index, current.token_index,
+                                                current.version, current.refresh_duration, crawl_ts, current.alive, current.page_ids)
+                return self.snapshot
+
+            category_urls, pages, page_states, crawl_ts = self.crawl_store.load()
+        except Exception as e:
+            print("Impossible to load the stored crawl.", e)
+            return current
+
+        # Unchanged pages keep their objects, so only changed ones are updated in the indexes
+        for url, page in pages.items():
+            state, old_state = page_states.get(url), self.crawler.page_states.get(url)
+            if url in self._pages and state is not None and old_state is not None and state.content_hash == old_state.content_hash:
+                pages[url] = self._pages[url]
+        self._category_urls, self._pages, self.crawler.page_states = category_urls, pages, page_states
+        with timed("build_snapshot"):
+            snapshot = self._build_snapshot(self._ordered_pages(), current, 0.0)
+        snapshot.created_ts = crawl_ts
+        self.snapshot = snapshot
+        self._store_pages_ts = pages_ts
+        self.result_cache.clear()
+        self.refresh_count += 1
+        return snapshot
+
+    def _prepare_page(self, page: CatalogPage, update_page: bool = True):
+        """(book vectors, preprocessed names) of the page, computed only for new or changed pages.
+
+        Other threads may read the page meanwhile: names are published before vectors, so a page with vectors
+        always has its names.
+        """
+        vectors, names_clean = page.vectors, page.names_clean
+        if vectors is None or names_clean is None:
+            names_clean = [self.matcher.preprocess_name(name) for name in page.books.names]
+            vectors = self.matcher.get_book_vectors(page.books.names)
+            if update_page:
+                page.names_clean = names_clean
+                page.vectors = vectors
+        return vectors, names_clean
+
+    def _build_snapshot(self, pages: list, current: CatalogSnapshot, refresh_duration: float, vector_index: str = None,
+                        update_pages: bool = True):
+        """Snapshot of pages [(page, is first page of category)], based on the current snapshot if possible.
+
+        Books of pages of the current snapshot keep their ids, books of new pages are appended with new ids, and
+        only books of new and removed pages are changed in the indexes. All ids are assigned again (full build)
+        when most of them would belong to removed pages.
+        """
+        vector_index = vector_index or self.vector_index
+        base = self._snapshot_base(current, pages, vector_index)
+        page_ids = {page: base.page_ids[page] for page, _ in pages if page in base.page_ids} if base else dict()
+        removed = [ids for page, ids in base.page_ids.items() if page not in page_ids] if base else []
+
+        next_id = len(base.books) if base else 0
+        tables, first_page, new_ids, new_vectors, new_names_clean = [], [], [], [], []
+        for page, is_first in pages:
+            if page in page_ids:
+                continue
+            # Only books of new or changed pages are embedded and preprocessed
+            page_vectors, page_names_clean = self._prepare_page(page, update_pages)
+            page_ids[page] = np.arange(next_id, next_id + len(page.books), dtype=np.int64)
+            next_id += len(page.books)
+            tables.append(page.books)
+            first_page.extend([is_first] * len(page.books))
+            new_ids.append(page_ids[page])
+            new_vectors.append(page_vectors)
+            new_names_clean.extend(page_names_clean)
+
+        removed = np.concatenate(removed) if removed else np.zeros(0, dtype=np.int64)
+        new_ids = np.concatenate(new_ids) if new_ids else np.zeros(0, dtype=np.int64)
+        new_vectors = np.vstack(new_vectors) if new_vectors else np.zeros((0, self.matcher.word_vectors.vector_size), dtype=np.float32)
+        first_page = np.array(first_page, dtype=bool)
+        if base is None:
+            books, alive = BookTable.concat(tables), np.ones(len(new_ids), dtype=bool)
+            book_index = self._build_vector_index(new_vectors, current.book_index if current else None, vector_index, new_ids)
+            token_index = self.matcher.build_token_index(new_names_clean, new_ids.tolist())
+        else:
+            books, first_page = BookTable.concat([base.books] + tables), np.concatenate([base.first_page, first_page])
+            alive = np.concatenate([base.alive, np.ones(len(new_ids), dtype=bool)])
+            alive[removed] = False
+            book_index = base.book_index.updated(removed, new_ids, new_vectors)
+            token_index = base.token_index.updated(removed, zip(new_ids.tolist(), new_names_clean))
+        return CatalogSnapshot(books, first_page, book_index, token_index, (current.version if current else 0) + 1,
+                               refresh_duration, alive=alive, page_ids=page_ids)
+
+    @staticmethod
+    def _snapshot_base(current: CatalogSnapshot, pages: list, vector_index: str):
+        """Current snapshot if the next one can be built on top of it, None for a full build."""
+        if current is None or type(current.book_index) is not VECTOR_INDEXES[vector_index]:
+            return None
+        kept = {page for page, _ in pages if page in current.page_ids}
+        unused = len(current.books) - len(current) + sum(len(ids) for page, ids in current.page_ids.items() if page not in kept)
+        new = sum(len(page.books) for page, _ in pages if page not in kept)
+        # Ids of removed books are not reused, start again when they are the majority
+        if unused > (len(current.books) + new) / 2:
+            return None
+        # Lists of the approximate index are trained again when the catalog size changed a lot
+        n_books = len(current.books) - unused + new
+        if isinstance(current.book_index, IVFIndex) and not 0.5 <= current.book_index.n_lists / max(1.0, np.sqrt(n_books)) <= 2:
+            return None
+        return current
+
+    def _build_vector_index(self, vectors: np.ndarray, previous: BookVectorIndex = None, vector_index: str = None,
+                            book_ids: np.ndarray = None):
+        book_ids = np.arange(len(vectors)) if book_ids is None else book_ids
+        vector_index = vector_index or self.vector_index
+        if vector_index == "exact":
+            return BookVectorIndex(vectors, book_ids)
+
+        # Centroids of the previous index are reused while the catalog size is similar
+        centroids = None
+        if isinstance(previous, IVFIndex) and 0.5 <= previous.n_lists / max(1.0, np.sqrt(len(vectors))) <= 2:
+            centroids = previous.centroids
+        return VECTOR_INDEXES[vector_index](vectors, book_ids, n_probe=self.n_probe, centroids=centroids)
+
+    def get_snapshot_metrics(self):
+        snapshot = self.snapshot
+        metrics = snapshot.get_metrics() if snapshot else {"version": 0, "books": 0}
+        metrics.update({
+            "ready": self.is_ready(),
+            "refreshing": self._refresh_lock.locked(),
+            "refresh_count": self.refresh_count,
+            "refresh_errors": self.refresh_errors,
+            "last_crawl": dict(self.crawler.stats),
+            # First failures of the last crawl, pages of the previous crawl are served instead
+            "crawl_failures": [failure.to_dict() for failure in self.crawler.failures[:20]],
+            "circuits": self.crawler.get_circuit_states(),
+        })
+        return metrics
+
+    def get_cache_stats(self):
+        stats = self.matcher.get_cache_stats()
+        stats["result"] = self.result_cache.get_stats()
+        return stats
+
+    def collect_metrics(self):
+        """Cache and snapshot metrics in the format of metrics.MetricsRegistry collectors."""
+        caches = self.get_cache_stats()
+        snapshot = self.get_snapshot_metrics()
+        metrics = [
+            ("book_search_snapshot_version", "gauge", "Version of the served catalog snapshot.", [({}, snapshot["version"])]),
+            ("book_search_snapshot_books", "gauge", "Books in the served catalog snapshot.", [({}, snapshot["books"])]),
+            ("book_search_refreshes_total", "counter", "Finished catalog refreshes.", [({}, self.refresh_count)]),
+            ("book_search_refresh_errors_total", "counter", "Failed catalog refreshes.", [({}, self.refresh_errors)]),
+        ]
+        if "age_s" in snapshot:
+            metrics.append(("book_search_snapshot_age_seconds", "gauge", "Age of the served catalog snapshot.", [({}, snapshot["age_s"])]))
+        for key, kind, help in [("hits", "counter", "Cache hits."), ("misses", "counter", "Cache misses."),
+                                ("evictions", "counter", "Cache evictions."), ("entries", "gauge", "Cache entries.")]:
+            name = f"book_search_cache_{key}" + ("_total" if kind == "counter" else "")
+            metrics.append((name, kind, help, [({"cache": cache}, stats[key]) for cache, stats in caches.items()]))
+        return metrics
+
+    def _crawl_catalog(self):
+        """Crawl all categories and pages, extended info is always collected.
+
+        Pages that did not change since the previous crawl are not parsed again. Pages that could not be crawled
+        are replaced by their version of the previous crawl (if any), and the rest of their category is still crawled.
+        Returns list of (page, is first page of category) in the order of categories, and if anything changed.
+        """
+        new_pages, changed = dict(), False
+        # First page of the category of every page, and pages of every category crawled so far
+        category_of, category_pages = dict(), dict()
+
+        def on_page(url: str, markup: str, page_changed: bool):
+            nonlocal changed
+            # Main page, get categories and crawl all of them concurrently
+            if url == self.BOOK_SHOP_URL:
+                if page_changed or not self._category_urls:
+                    with timed("parse"):
+                        category_urls = [urljoin(url, link) for link in self.parser.parse_category_links(markup).values()]
+                    changed |= category_urls != self._category_urls
+                    self._category_urls = category_urls
+                return list(self._category_urls)
+
+            page = self._pages.get(url) if not page_changed else None
+            if page is None:
+                changed = True
+                with timed("parse"):
+                    books, next_page = self.parser.parse_category_page(markup)
+                page = CatalogPage([book for _, book in books], urljoin(url, next_page) if next_page else None)
+
+            new_pages[url] = page
+            category = category_of.setdefault(url, url)
+            category_pages.setdefault(category, []).append(page)
+            if page.next_url:
+                category_of[page.next_url] = category
+                return [page.next_url]
+
+            # Last page, the category is complete
+            for listener in list(self._category_listeners):
+                listener(category, category_pages[category])
+
+        def on_failure(url: str):
+            # Stale page is better than a missing one
+            if url in self._pages or (url == self.BOOK_SHOP_URL and self._category_urls):
+                return on_page(url, None, False)
+
+        def is_cached(url: str):
+            # Pages without a parsed version must not be answered 304
+            return url in self._pages or (url == self.BOOK_SHOP_URL and bool(self._category_urls))
+
+        self.crawler.run([self.BOOK_SHOP_URL], on_page, on_failure, is_cached)
+        changed |= new_pages.keys() != self._pages.keys()
+        self._pages = new_pages
+        # Validators of pages that are gone would be sent if they come back, and stored
+        self.crawler.page_states = {url: state for url, state in self.crawler.page_states.items()
+                                    if url in new_pages or url == self.BOOK_SHOP_URL}
+
+        return self._ordered_pages(), changed
+
+    def _ordered_pages(self):
+        """List of (page, is first page of category) in the order of categories and pages."""
+        pages = []
+        for url in self._category_urls:
+            is_first = True
+            while url in self._pages:
+                pages.append((self._pages[url], is_first))
+                url, is_first = self._pages[url].next_url, False
+        return pages
+
+    def _search_snapshot(self, snapshot: CatalogSnapshot, queries: list, extended_info: bool = False, search_all_pages: bool = False,
+                         filters: dict = None, sort_by: str = None):
+        allowed = None if search_all_pages else snapshot.first_page
+        if filters:
+            mask = snapshot.books.mask(**filters)
+            allowed = mask if allowed is None else mask & allowed
+        with timed("embed"):
+            query_vectors = self.matcher.get_embedding_vectors(queries)
+        if self.use_embeddings:
+            with timed("vector_search"):
+                top_matches = snapshot.book_index.search(query_vectors, self.best_k_matches, self.matcher.similarity_threshold, mask=allowed)
+        else:
+            no_match = np.zeros(0, dtype=np.int64)
+            top_matches = [(no_match, no_match) for _ in queries]
+
+        n_cols = None if extended_info else 2
+        all_res = []
+        for query, query_vector, (book_ids, sims) in zip(queries, query_vectors, top_matches):
+            # Get k best, if matched by name then prioritize
+            with timed("token_search"):
+                book_ids_simple = snapshot.token_index.search(query)
+                if allowed is not None:
+                    book_ids_simple = book_ids_simple[allowed[book_ids_simple]]
+
+            with timed("rank"):
+                # Books matched by embeddings are ranked by similarity instead
+                if self.use_embeddings and len(book_ids_simple) > 0:
+                    simple_sims = snapshot.book_index.score_books(query_vector, book_ids_simple)
+                    book_ids_simple = book_ids_simple[np.abs(simple_sims) <= self.matcher.similarity_threshold]
+                matches = [(list(query), book_id) for book_id in book_ids_simple[:self.best_k_matches]]
+                matches.extend((float(sim), book_id) for book_id, sim in zip(book_ids, sims))
+                matches = matches[0:self.best_k_matches]
+
+                if sort_by and matches:
+                    order = snapshot.books.argsort([book_id for _, book_id in matches], sort_by.lstrip("-"), sort_by.startswith("-"))
+                    matches = [matches[i] for i in order]
+                all_res.append([[match] + snapshot.books.row(book_id)[:n_cols] for match, book_id in matches])
+
+        return all_res
+
 
 def get_matching_result_table(query: str, matches: list, to_print=True):
     line_breaker = "\n" if to_print else "<br/>" 
@@ -170,8 +594,7 @@ def get_matching_result_table(query: str, matches: list, to_print=True):
     names = ["Matching", "Name", "Price", "Avail.", "Raiting"] if len(matches[0]) > 3 else ["Name", "Price"]
     lines += (row_format.format(*names) + line_breaker)
     for row in matches:
-        row[0] = str(row[0])
-        lines += (row_format.format(*row) + line_breaker)
+        lines += (row_format.format(str(row[0]), *row[1:]) + line_breaker)
 
     lines += ("+-----------------------------------------------------------------------------+" + line_breaker)
     
@@ -0,0 +1,79 @@
+"""Production serving of the REST API.
+
+Pre-fork mode (gunicorn, used when workers > 1): the app, the word2vec model and the catalog snapshot are loaded
+once in the master process before the workers are forked, so the workers share them read-only (copy-on-write,
+book embeddings are memory-mapped). Every worker serves requests on a pool of threads.
+Threaded mode (one worker or gunicorn not installed): a single process, multi-threaded Werkzeug server.
+
+In both modes refreshes are single-flight: one thread crawls while the other requests are answered from the last
+snapshot. In pre-fork mode a single worker (holding the lock file of the crawl store) crawls the shop, the other
+workers load new catalogs from the crawl store instead of crawling. Without a crawl store every worker crawls, and
+the crawl rate limit is divided between them.
+
+Usage: python serve.py [--host 127.0.0.1] [--port 5000] [--workers 4] [--threads 8]
+"""
+import argparse
+import os
+from werkzeug.serving import run_simple
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+import rest
+
+
+def run_prefork(app, host: str, port: int, workers: int, threads: int, timeout: int = 60, post_fork=None):
+    class PreforkApplication(BaseApplication):
+        def load_config(self):
+            options = {"bind": f"{host}:{port}", "workers": workers, "threads": threads,
+                       "worker_class": "gthread", "preload_app": True, "timeout": timeout}
+            if post_fork is not None:
+                options["post_fork"] = post_fork
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    PreforkApplication().run()
+
+
+def run_threaded(app, host: str, port: int):
+    # Werkzeug starts a thread per request
+    print(f"Serving on http://{host}:{port} with one threaded worker.")
+    run_simple(host, port, app, threaded=True)
+
+
+def serve(host: str = "127.0.0.1", port: int = 5000, workers: int = None, threads: int = 8):
+    workers = workers or min(4, os.cpu_count())
+    # Load models and crawl before forking, so all workers start ready, from the same warm snapshot
+    rest.BOOK_SCRAPER.warm_up()
+
+    if workers > 1 and BaseApplication is not None:
+        scraper = rest.BOOK_SCRAPER
+        if scraper.crawl_store is None:
+            # Every worker crawls, the shop sees the sum of their rates
+            if scraper.crawler.rate_limit:
+                scraper.crawler.rate_limit /= workers
+                scraper.crawler.buckets.clear()
+            post_fork = None
+        else:
+            # One worker crawls, the others follow the crawl store
+            post_fork = lambda server, worker: scraper.share_refresh()
+        run_prefork(rest.api, host, port, workers, threads, post_fork=post_fork)
+    else:
+        if workers > 1:
+            print("gunicorn is not installed, serving with one worker.")
+        run_threaded(rest.api, host, port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the book search API with several workers and threads.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None, help="processes, default min(4, cpu count)")
+    parser.add_argument("--threads", type=int, default=8, help="threads per worker process")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.threads)
@@ -0,0 +1,77 @@
+import json
+import os
+import numpy as np
+
+
+def fnv1a(data: bytes):
+    """32 bit FNV-1a hash, the same in every process (unlike hash() of str)."""
+    h = 2166136261
+    for byte in data:
+        h = ((h ^ byte) * 16777619) & 0xFFFFFFFF
+    return h
+
+
+class SubwordVectors():
+    """Vectors of words out of the word2vec vocabulary, built from hashed character n-grams (as in FastText).
+
+    A word is the mean of the rows of its n-grams (of "<word>") in one flat float32 matrix of n_buckets rows,
+    if at least min_known of its n-grams have a row (so random strings are not embedded through hash collisions).
+    On disk: `<path>.npy` with the matrix, memory-mapped on load so worker processes share it,
+    and `<path>.json` with n-gram lengths.
+    """
+
+    def __init__(self, vectors: np.ndarray, min_n: int = 3, max_n: int = 5, min_known: float = 0.5) -> None:
+        self.vectors = vectors
+        self.min_n = min_n
+        self.max_n = max_n
+        self.min_known = min_known
+
+    @property
+    def n_buckets(self):
+        return self.vectors.shape[0]
+
+    @property
+    def vector_size(self):
+        return self.vectors.shape[1]
+
+    def buckets(self, word: str):
+        token = f"<{word}>"
+        return [fnv1a(token[i:i + n].encode("utf-8")) % self.n_buckets
+                for n in range(self.min_n, self.max_n + 1) for i in range(len(token) - n + 1)]
+
+    def get(self, word: str):
+        """Vector of the word, None if too few of its n-grams are known."""
+        rows = self.vectors[self.buckets(word)]
+        known = np.any(rows != 0, axis=1)
+        if not known.any() or known.mean() < self.min_known:
+            return None
+        return rows[known].mean(axis=0)
+
+    @classmethod
+    def from_word_vectors(cls, word_vectors, n_buckets: int = 2**15, min_n: int = 3, max_n: int = 5, min_known: float = 0.5):
+        """Bucket rows are means of the vectors of vocabulary words containing the n-gram, so they are in the same space."""
+        subwords = cls(np.zeros((n_buckets, word_vectors.vector_size), dtype=np.float32), min_n, max_n, min_known)
+        sums = np.zeros_like(subwords.vectors, dtype=np.float64)
+        counts = np.zeros(n_buckets)
+        for word, vector in zip(word_vectors.index_to_key, word_vectors.vectors):
+            buckets = subwords.buckets(word)
+            np.add.at(sums, buckets, vector)
+            np.add.at(counts, buckets, 1)
+        known = counts > 0
+        subwords.vectors[known] = sums[known] / counts[known, None]
+        return subwords
+
+    @staticmethod
+    def exists(path: str):
+        return os.path.exists(path + ".npy") and os.path.exists(path + ".json")
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r"):
+        with open(path + ".json") as fp:
+            meta = json.load(fp)
+        return cls(np.load(path + ".npy", mmap_mode=mmap_mode), meta["min_n"], meta["max_n"], meta["min_known"])
+
+    def save(self, path: str):
+        np.save(path + ".npy", np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(path + ".json", "w") as fp:
+            json.dump({"min_n": self.min_n, "max_n": self.max_n, "min_known": self.min_known}, fp)
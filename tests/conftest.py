@@ -0,0 +1,52 @@
+import sys
+from os.path import dirname, abspath, join
+
+import pytest
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(join(ROOT, "benchmarks"))
+
+from site_snapshot import SiteServer, render_site, get_book_names
+
+
+def has_nltk_data():
+    import nltk
+    try:
+        nltk.data.find("corpora/wordnet")
+        nltk.data.find("tokenizers/punkt")
+    except LookupError:
+        return False
+    return True
+
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    # Models and book names are loaded from paths relative to the repository
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def book_names():
+    return get_book_names(n_books=100)
+
+
+@pytest.fixture
+def site(book_names):
+    """Offline shop of 3 categories of 2 pages each, without book pages."""
+    with SiteServer(render_site(book_names, n_categories=3, book_pages=False)) as server:
+        yield server
+
+
+@pytest.fixture
+def scraper(site, monkeypatch):
+    """Scraper of the offline shop, without rate limit and retries."""
+    # Book names are preprocessed with NLTK, download its data with `python -m nltk.downloader wordnet punkt`
+    if not has_nltk_data():
+        pytest.skip("NLTK data is not installed")
+    from search_data import BookSearchScraper
+    monkeypatch.setattr(BookSearchScraper, "BOOK_SHOP_URL", site.base_url + "/index.html")
+    monkeypatch.setattr(BookSearchScraper, "BOOK_SHOP_BASE_URL", site.base_url)
+    scraper = BookSearchScraper(cache_update_ts=300, rate_limit=None)
+    scraper.crawler.retries = 0
+    return scraper
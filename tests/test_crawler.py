@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from crawler import AsyncCrawler
+
+CATEGORY = "/catalogue/category/books/category-0_2/"
+
+
+def crawl(crawler, urls, on_failure=None):
+    """Urls of the pages downloaded by the crawler."""
+    fetched = []
+
+    def on_page(url, markup, changed):
+        fetched.append(url)
+
+    crawler.run(urls, on_page, on_failure)
+    return fetched
+
+
+@pytest.mark.parametrize("status", [503, 429])
+def test_retries_wait_for_retry_after(site, status):
+    url = site.base_url + CATEGORY + "index.html"
+    site.set_faults(error_rate=1.0, error_status=status, retry_after=0.3)
+    # Without Retry-After, all retries would be sent before the host recovers
+    threading.Timer(0.15, site.set_faults).start()
+    crawler = AsyncCrawler(retries=3, backoff=0.01, rate_limit=None)
+
+    start = time.monotonic()
+    assert crawl(crawler, [url]) == [url]
+    assert time.monotonic() - start >= 0.3
+    assert site.requests_served == 2
+    assert crawler.failures == []
+
+
+def test_failure_after_retries(site):
+    url = site.base_url + CATEGORY + "index.html"
+    site.set_faults(error_rate=1.0, error_status=503)
+    crawler = AsyncCrawler(retries=2, backoff=0.01, rate_limit=None)
+
+    assert crawl(crawler, [url]) == []
+    assert site.requests_served == 3
+    failure = crawler.failures[0]
+    assert (failure.url, failure.reason, failure.status, failure.attempts) == (url, "server_error", 503, 3)
+
+
+def test_circuit_opens_and_lets_one_trial_through(site):
+    urls = [site.base_url + CATEGORY + page for page in ("index.html", "page-2.html")]
+    host = site.base_url.split("//")[1]
+    site.set_faults(error_rate=1.0)
+    crawler = AsyncCrawler(retries=0, rate_limit=None, failure_threshold=2, reset_timeout=0.3)
+
+    crawl(crawler, urls)
+    assert crawler.get_circuit_states() == {host: "open"}
+
+    # Open: fails without sending the request
+    assert crawl(crawler, urls[:1]) == []
+    assert crawler.failures[0].reason == "circuit_open"
+    assert site.requests_served == 2
+
+    # Half-open: one trial request, the circuit stays open when it fails
+    time.sleep(0.35)
+    assert crawler.get_circuit_states() == {host: "half_open"}
+    crawl(crawler, urls)
+    assert site.requests_served == 3
+    assert sorted(failure.reason for failure in crawler.failures) == ["circuit_open", "server_error"]
+    assert crawler.get_circuit_states() == {host: "open"}
+
+    # A successful trial closes it
+    time.sleep(0.35)
+    site.set_faults()
+    assert crawl(crawler, urls[:1]) == urls[:1]
+    assert crawler.get_circuit_states() == {host: "closed"}
+    assert crawl(crawler, urls[1:]) == urls[1:]
+
+
+def test_deadline_returns_partial_results(site):
+    urls = [site.base_url + f"/catalogue/category/books/category-{i}_{i + 2}/index.html" for i in range(3)]
+    site.set_faults(latency=2.0, paths=["/catalogue/category/books/category-2_4/"])
+    crawler = AsyncCrawler(rate_limit=None, max_crawl_time=0.5)
+    recovered = []
+
+    start = time.monotonic()
+    assert sorted(crawl(crawler, urls, recovered.append)) == urls[:2]
+    assert time.monotonic() - start < 1.5
+    assert [(failure.url, failure.reason) for failure in crawler.failures] == [(urls[2], "deadline")]
+    assert recovered == urls[2:]
+
+
+def test_on_failure_links_are_followed(site):
+    first, second = site.base_url + CATEGORY + "index.html", site.base_url + CATEGORY + "page-2.html"
+    site.set_faults(error_rate=1.0, paths=[CATEGORY + "index.html"])
+    crawler = AsyncCrawler(retries=0, rate_limit=None)
+
+    # e.g. the next page of the last good version of the failed page
+    assert crawl(crawler, [first], lambda url: [second] if url == first else None) == [second]
+    assert crawler.failed_urls == [first]
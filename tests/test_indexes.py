@@ -0,0 +1,132 @@
+import copy
+
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex
+from match_books import BookVectorIndex, InvertedIndex
+
+DIM = 16
+VOCABULARY = ["alice", "wonder", "land", "harry", "potter", "stone", "night", "day", "sea", "star"]
+
+
+def random_vectors(rng, n_books=300):
+    return {book_id: rng.normal(size=DIM).astype(np.float32) for book_id in range(n_books)}
+
+
+def random_batches(rng, vectors, n_steps=25):
+    """(removed ids, added ids, their vectors) of the books in vectors, some added ids are updates.
+
+    The caller applies every batch to vectors before the next one is drawn.
+    """
+    next_id = max(vectors) + 1
+    for step in range(n_steps):
+        live = np.array(sorted(vectors))
+        # Large removals now and then, so that the IVF index is compacted
+        n_removed = rng.integers(0, len(live) * 3 // 4 if step % 7 == 6 else 40)
+        removed = rng.choice(live, n_removed, replace=False)
+        kept = np.setdiff1d(live, removed)
+        updated = rng.choice(kept, min(len(kept), rng.integers(0, 10)), replace=False)
+        new = np.arange(next_id, next_id + rng.integers(0, 60))
+        next_id += len(new)
+
+        added = np.concatenate([updated, new]).astype(np.int64)
+        added_vectors = rng.normal(size=(len(added), DIM)).astype(np.float32)
+        yield removed, added, added_vectors
+
+
+def apply_batch(vectors, batch):
+    removed, added, added_vectors = batch
+    for book_id in removed.tolist():
+        del vectors[book_id]
+    vectors.update(zip(added.tolist(), added_vectors))
+
+
+def exact_index(vectors):
+    book_ids = np.array(sorted(vectors), dtype=np.int64)
+    return BookVectorIndex(np.array([vectors[book_id] for book_id in book_ids.tolist()]).reshape(-1, DIM), book_ids)
+
+
+def assert_same_results(results, expected):
+    for (book_ids, scores), (expected_ids, expected_scores) in zip(results, expected):
+        np.testing.assert_array_equal(book_ids, expected_ids)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+
+
+def searched(index, queries, mask=None):
+    return index.search(queries, k=10, threshold=0.0, mask=mask)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("kind", ["exact", "ivf_all_lists", "ivf"])
+def test_updated_vector_index_matches_rebuilt_index(kind, seed):
+    rng = np.random.default_rng(seed)
+    vectors = random_vectors(rng)
+    queries = rng.normal(size=(8, DIM)).astype(np.float32)
+    index = exact_index(vectors)
+    if kind != "exact":
+        index = IVFIndex(index.matrix, index.book_ids, n_lists=16, n_probe=16 if kind == "ivf_all_lists" else 4)
+
+    for batch in random_batches(rng, vectors):
+        before = searched(index, queries)
+        arrays = copy.deepcopy((index.book_ids, index.matrix, index._row_of))
+
+        new_index = index.updated(*batch)
+        apply_batch(vectors, batch)
+
+        # The previous index (of the served snapshot) is not modified
+        assert_same_results(searched(index, queries), before)
+        np.testing.assert_array_equal(index.book_ids, arrays[0])
+        np.testing.assert_array_equal(index.matrix, arrays[1])
+        assert index._row_of == arrays[2]
+
+        index = new_index
+        assert len(index) == len(vectors)
+        expected = exact_index(vectors)
+        mask = rng.random(max(vectors) + 1) < 0.5
+        if kind == "ivf":
+            # Same lists as a new index with the same centroids
+            expected = IVFIndex(expected.matrix, expected.book_ids, n_probe=4, centroids=index.centroids)
+        assert_same_results(searched(index, queries), searched(expected, queries))
+        assert_same_results(searched(index, queries, mask), searched(expected, queries, mask))
+        book_ids = rng.choice(expected.book_ids, 5)
+        np.testing.assert_allclose(index.score_books(queries[0], book_ids), expected.score_books(queries[0], book_ids), atol=1e-5)
+
+
+def random_tokens(rng):
+    return list(rng.choice(VOCABULARY, rng.integers(1, 4)))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_updated_token_index_matches_rebuilt_index(seed):
+    rng = np.random.default_rng(seed)
+    names = {book_id: random_tokens(rng) for book_id in range(200)}
+    index = InvertedIndex()
+    for book_id, tokens in names.items():
+        index.add(book_id, tokens)
+    next_id = len(names)
+
+    for _ in range(25):
+        live = np.array(sorted(names))
+        removed = rng.choice(live, rng.integers(0, 40), replace=False)
+        updated = rng.choice(np.setdiff1d(live, removed), rng.integers(0, 10), replace=False)
+        new = range(next_id, next_id + int(rng.integers(0, 40)))
+        next_id += len(new)
+        added = [(book_id, random_tokens(rng)) for book_id in updated.tolist() + list(new)]
+
+        before = copy.deepcopy((index.postings, index.book_tokens))
+        new_index = index.updated(np.concatenate([removed, updated]), added)
+        assert (index.postings, index.book_tokens) == before
+
+        for book_id in removed.tolist():
+            del names[book_id]
+        names.update(added)
+        expected = InvertedIndex()
+        for book_id, tokens in names.items():
+            expected.add(book_id, tokens)
+
+        index = new_index
+        assert index.postings == expected.postings
+        assert index.book_tokens == expected.book_tokens
+        for query in (["alice"], ["harry", "potter"], ["sea", "star", "night"], ["unknown"]):
+            np.testing.assert_array_equal(index.search(query), expected.search(query))
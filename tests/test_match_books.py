@@ -0,0 +1,23 @@
+import os
+import shutil
+
+from match_books import Matcher
+
+
+def matcher_in(directory, use_subwords=True):
+    return Matcher(word_vectors_path=os.path.join(directory, "word2vec.kv"), model_path=os.path.join(directory, "word2vec.model"),
+                   data_embeddings_path=os.path.join(directory, "w2v_avg_vectors"),
+                   subword_vectors_path=os.path.join(directory, "subword_vectors"), use_subwords=use_subwords)
+
+
+def test_fingerprint_depends_on_contents_only(tmp_path):
+    fingerprint = matcher_in("embeddings").fingerprint()
+    # A fresh copy of the same files, with new modification times
+    copy = tmp_path / "embeddings"
+    shutil.copytree("embeddings", copy, copy_function=shutil.copy)
+    assert matcher_in(str(copy)).fingerprint() == fingerprint
+
+    with open(copy / "w2v_avg_vectors.npy", "ab") as fp:
+        fp.write(b"\0")
+    assert matcher_in(str(copy)).fingerprint() != fingerprint
+    assert matcher_in("embeddings", use_subwords=False).fingerprint() != fingerprint
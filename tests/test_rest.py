@@ -0,0 +1,57 @@
+import pytest
+from flask import json
+
+
+@pytest.fixture
+def rest():
+    # Imported from the repository directory, its scraper opens data/crawl_cache.sqlite
+    import rest
+    return rest
+
+
+@pytest.fixture
+def client(rest, scraper, monkeypatch):
+    # Scraper of the offline shop, without a snapshot
+    monkeypatch.setattr(rest, "BOOK_SCRAPER", scraper)
+    return rest.api.test_client()
+
+
+def ndjson(response):
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch(client):
+    response = client.post("/search/batch", json={"queries": ["alice", "sapiens"], "search_all_pages": True,
+                                                  "filters": {"min_rating": 1}, "sort_by": "-price"})
+    assert response.status_code == 200
+    results = json.loads(response.get_data(as_text=True))["results"]
+    assert [res["query"] for res in results] == ["alice", "sapiens"]
+
+
+def test_stream_per_category_on_cold_cache(client, site):
+    lines = ndjson(client.post("/search/batch", json={"queries": ["alice", "sapiens"], "stream": True}))
+    # One line per category of the shop, then the results over the whole catalog
+    assert len(lines) == 4
+    assert all(line["category"].startswith(site.base_url) and not line["final"] for line in lines[:-1])
+    assert lines[-1]["category"] is None and lines[-1]["final"]
+    assert all([res["query"] for res in line["results"]] == ["alice", "sapiens"] for line in lines)
+
+    # Warm cache: only the final line
+    lines = ndjson(client.post("/search/batch", json={"queries": ["alice"], "stream": True}))
+    assert [(line["category"], line["final"]) for line in lines] == [(None, True)]
+
+
+@pytest.mark.parametrize("body", [
+    "{}", "not json", '{"queries": "alice"}', '{"queries": ["alice", 1]}',
+    '{"queries": ["alice"], "filters": [1]}', '{"queries": ["alice"], "filters": {"color": 1}}',
+    '{"queries": ["alice"], "filters": {"max_price": "10"}}', '{"queries": ["alice"], "filters": {"min_price": NaN}}',
+    '{"queries": ["alice"], "filters": {"max_price": Infinity}}', '{"queries": ["alice"], "sort_by": "name"}',
+    '{"queries": ["alice"], "sort_by": ["price"]}', '{"queries": ["alice"], "sort_by": "price", "stream": true, "filters": {"min_rating": -Infinity}}',
+])
+def test_bad_batch_is_rejected(rest, body):
+    # Rejected before any search, the scraper is not used
+    response = rest.api.test_client().post("/search/batch", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert "error" in json.loads(response.get_data(as_text=True))
@@ -0,0 +1,120 @@
+import math
+
+import pytest
+
+from conftest import render_site
+from metrics import QUERIES, STAGE_SECONDS
+from search_data import BookSearchScraper
+
+
+def test_crawl_follows_pagination(site, scraper, book_names):
+    snapshot = scraper.refresh_snapshot()
+    # Index and 2 pages in each of 3 categories
+    assert site.requests_served == 7
+    assert sorted(snapshot.books.names) == sorted(name.lower() for name in book_names)
+    # 20 books on the first page of every category
+    assert snapshot.first_page.sum() == 60
+
+    results = scraper.collect_search_data(book_names[-1], search_all_pages=True)
+    assert results[0][1] == book_names[-1].lower()
+
+
+def test_cached_results_are_not_shared(scraper, book_names):
+    query = book_names[0]
+    results = scraper.collect_search_data(query, extended_info=True, search_all_pages=True)
+    expected = [[list(row[0]) if isinstance(row[0], list) else row[0]] + row[1:] for row in results]
+    for row in results:
+        if isinstance(row[0], list):
+            row[0].append("changed")
+        row[1] = "changed"
+
+    assert scraper.collect_search_data(query, extended_info=True, search_all_pages=True) == expected
+    assert scraper.result_cache.get_stats()["hits"] == 1
+
+
+def search_count():
+    return QUERIES.values.get((), 0), STAGE_SECONDS.values.get((("stage", "search"), ), [None, 0.0, 0])[2]
+
+
+def test_streamed_searches_are_counted(scraper):
+    queries, searches = search_count()
+    # Cold cache: one item per category, then the whole catalog
+    assert len(list(scraper.iter_search_data_batch(["alice", "sapiens"]))) == 4
+    list(scraper.iter_search_data_batch(["alice"]))
+    assert search_count() == (queries + 3, searches + 2)
+
+
+def test_unchanged_catalog_keeps_snapshot_version(site, scraper, book_names):
+    first = scraper.refresh_snapshot()
+    snapshot = scraper.refresh_snapshot()
+    # Conditional GETs: every page answers 304
+    assert scraper.crawler.stats["not_modified"] == 7
+    assert scraper.crawler.stats["fetched"] == 0
+    assert snapshot.version == first.version
+
+    names = list(book_names)
+    names[0] = "A New Book"
+    site.set_pages(render_site(names, n_categories=3, book_pages=False))
+    snapshot = scraper.refresh_snapshot()
+    # The index and the category page list the book, the other pages answer 304
+    assert scraper.crawler.stats["changed"] == 2
+    assert scraper.crawler.stats["not_modified"] == 5
+    assert snapshot.version == first.version + 1
+    assert "a new book" in snapshot.books.names
+
+
+def test_pages_that_come_back_are_parsed_again(site, scraper, book_names):
+    scraper.refresh_snapshot()
+    # 20 books in each category, second pages disappear
+    site.set_pages(render_site(book_names[:60], n_categories=3, book_pages=False))
+    assert len(scraper.refresh_snapshot()) == 60
+
+    # Second pages come back unchanged, they are not answered 304 since their books were dropped
+    site.set_pages(render_site(book_names, n_categories=3, book_pages=False))
+    snapshot = scraper.refresh_snapshot()
+    assert scraper.crawler.failures == []
+    names = [name for name, alive in zip(snapshot.books.names, snapshot.alive) if alive]
+    assert sorted(names) == sorted(name.lower() for name in book_names)
+    assert len(scraper.crawler.page_states) == 7
+
+
+def test_failed_pages_are_served_from_last_crawl(site, scraper):
+    first = scraper.refresh_snapshot()
+    failed = site.base_url + "/catalogue/category/books/category-1_3/index.html"
+    site.set_faults(error_rate=1.0, paths=["/catalogue/category/books/category-1_3/index.html"])
+
+    snapshot = scraper.refresh_snapshot()
+    assert len(snapshot) == len(first)
+    assert snapshot.version == first.version
+    metrics = scraper.get_snapshot_metrics()
+    assert [failure["url"] for failure in metrics["crawl_failures"]] == [failed]
+    # The rest of the category is still crawled, from the next page of the stale one
+    assert metrics["last_crawl"]["not_modified"] == 6
+
+
+def test_shop_outage_is_a_refresh_error(site, scraper, tmp_path):
+    scraper = BookSearchScraper(cache_update_ts=300, rate_limit=None, store_path=str(tmp_path / "crawl.sqlite"))
+    scraper.crawler.retries = 0
+    first = scraper.refresh_snapshot()
+    site.set_faults(error_rate=1.0)
+
+    snapshot = scraper.refresh_snapshot()
+    assert snapshot is first
+    assert scraper.refresh_errors == 1
+    # Followers must not take the stored crawl as fresh either
+    assert scraper.crawl_store.get_timestamps()[1] == first.created_ts
+
+
+@pytest.mark.parametrize("filters, sort_by", [
+    ([1], None), ({"max_price": "10"}, None), ({"color": 1}, None), ({"min_price": math.nan}, None),
+    ({"max_price": math.inf}, None), ({"min_price": -math.inf}, None), ({"min_price": 1e307}, None),
+    (None, "name"), (None, ["price"]),
+])
+def test_bad_search_options_are_rejected(filters, sort_by):
+    with pytest.raises(ValueError):
+        BookSearchScraper.check_search_options(filters, sort_by)
+
+
+def test_search_options():
+    BookSearchScraper.check_search_options({"min_price": 10, "max_price": 40.5, "min_rating": 3, "available": True}, "-rating")
+    BookSearchScraper.check_search_options(None, None)
@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_store import convert_pickle
+from subword import SubwordVectors
+
+
+def convert_word_vectors(model_path: str = "embeddings/word2vec.model", path_out: str = "embeddings/word2vec.kv"):
+    """Save only the word vectors of a trained Word2Vec model, with the matrix in a separate .npy to be memory-mapped."""
+    from gensim.models import Word2Vec
+    word_vectors = Word2Vec.load(model_path).wv
+    # Lock factors are only used for training
+    word_vectors.save(path_out, sep_limit=0, ignore=["vectors_lockf"])
+    return word_vectors
+
+
+def convert_subword_vectors(path_in: str = "embeddings/word2vec.kv", path_out: str = "embeddings/subword_vectors",
+                            n_buckets: int = 2**15):
+    """Store character n-gram vectors built from the word vectors, memory-mapped by the search engine."""
+    from gensim.models import KeyedVectors
+    subword_vectors = SubwordVectors.from_word_vectors(KeyedVectors.load(path_in, mmap="r"), n_buckets)
+    subword_vectors.save(path_out)
+    return subword_vectors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pickled book embeddings to a memory-mapped store.")
+    parser.add_argument("path_in", nargs="?", default=None)
+    parser.add_argument("path_out", nargs="?", default=None)
+    parser.add_argument("--word-vectors", action="store_true",
+                        help="convert the word2vec model (embeddings/word2vec.model) to word vectors (embeddings/word2vec.kv)")
+    parser.add_argument("--subwords", action="store_true",
+                        help="build n-gram vectors (embeddings/subword_vectors) from word vectors (embeddings/word2vec.kv)")
+    parser.add_argument("--n-buckets", type=int, default=2**15)
+    args = parser.parse_args()
+
+    if args.subwords:
+        path_out = args.path_out or "embeddings/subword_vectors"
+        subword_vectors = convert_subword_vectors(args.path_in or "embeddings/word2vec.kv", path_out, args.n_buckets)
+        print(f"Stored {subword_vectors.n_buckets} n-gram vectors of size {subword_vectors.vector_size} in {path_out}.npy")
+    elif args.word_vectors:
+        path_out = args.path_out or "embeddings/word2vec.kv"
+        word_vectors = convert_word_vectors(args.path_in or "embeddings/word2vec.model", path_out)
+        print(f"Stored {len(word_vectors)} word vectors of size {word_vectors.vector_size} in {path_out}")
+    else:
+        path_out = args.path_out or "embeddings/w2v_avg_vectors"
+        store = convert_pickle(args.path_in or "embeddings/w2v_avg_vectors.p", path_out)
+        print(f"Stored {len(store)} vectors of size {store.vectors.shape[1]} in {path_out}.npy")
@@ -1,151 +1,230 @@
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
-from enum import Enum
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
 import pandas as pd
 import re
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crawler import AsyncCrawler
+from parsers import Rating, get_parser
 
-class Rating(Enum):
-    Zero = 0
-    One = 1
-    Two = 2
-    Three = 3
-    Four = 4
-    Five = 5
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Parser of every worker process
+_PARSERS = dict()
+
+
+def _parse_desc_table(rows: list, expected: list):
+    all_keys = [th.lower() for th, _ in rows]
+    assert all_keys == expected, "Unknown keys"
+
+    def prepare_val(key: str, val:str):
+        if 'price' in key or 'tax' in key:
+            return float(val[1:])
+        elif key == 'availability':
+            return int(''.join(filter(str.isdigit, val)))
+        elif key == "number of reviews":
+            return int(val)
+        else:
+            return val
+
+    all_vals = [prepare_val(key, td) for key, (_, td) in zip(all_keys, rows)]
+
+    return dict(map(lambda i,j : (i,j) , all_keys, all_vals))
+
+
+def get_vals_from_description(parser_name: str, markup: str, expected_cols: list):
+    """Row of a book from its description page, runs in parser worker processes."""
+    try:
+        parser = _PARSERS.setdefault(parser_name, get_parser(parser_name))
+        name, description, rating, rows = parser.parse_book_page(markup)
+
+        book_vals = _parse_desc_table(rows, expected_cols)
+        book_vals["description"] = description
+        book_vals["name"] = name
+        book_vals["rating"] = str(Rating[rating])
+        return book_vals
+    except Exception as e:
+        print("Impossible to fetch book data from the description page.", e)
+
+
+class CsvWriter():
+    """Appends batches of rows to a CSV file, the same layout as DataFrame.to_csv of all rows at once."""
+
+    def __init__(self, path: str, columns: list) -> None:
+        self.path = path
+        self.columns = columns
+        self.rows_written = 0
+
+    def write(self, rows: list):
+        batch = pd.DataFrame(rows, columns=self.columns,
+                             index=pd.RangeIndex(self.rows_written, self.rows_written + len(rows)))
+        batch.to_csv(self.path, mode="w" if self.rows_written == 0 else "a", header=self.rows_written == 0)
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self.rows_written == 0:
+            pd.DataFrame(columns=self.columns).to_csv(self.path)
+
+
+class ParquetWriter():
+    """Appends batches of rows as row groups of a Parquet file, requires pyarrow."""
+
+    def __init__(self, path: str, columns: list) -> None:
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to write Parquet files.")
+        self.path = path
+        self.columns = columns
+        self.rows_written = 0
+        self._writer = None
+
+    def write(self, rows: list):
+        table = pyarrow.Table.from_pandas(pd.DataFrame(rows, columns=self.columns), preserve_index=False)
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def get_writer(path: str, columns: list):
+    return ParquetWriter(path, columns) if path.endswith(".parquet") else CsvWriter(path, columns)
 
 
 class BookDataScraper():
-    expected_cols = [ 
-        'url', 'description', 'name', 'rating', 'category', 
-        'upc', 'product type', 
-        'price (excl. tax)', 'price (incl. tax)', 'tax', 
+    """Extracts the whole shop, including book description pages.
+
+    Streaming pipeline of concurrent stages connected by bounded queues, so memory stays flat:
+    category pages -> book urls -> fetched book pages -> parsed rows (in worker processes) -> batched writes.
+    """
+
+    expected_cols = [
+        'url', 'description', 'name', 'rating', 'category',
+        'upc', 'product type',
+        'price (excl. tax)', 'price (incl. tax)', 'tax',
         'availability', 'number of reviews']
-    
+
     BOOK_SHOP_URL = "http://books.toscrape.com/index.html"
     BOOK_SHOP_BASE_URL = "http://books.toscrape.com"
 
 
-    def __init__(self, verbose: bool = False) -> None:
+    def __init__(self, verbose: bool = False, parser: str = "lxml", max_concurrency: int = 16,
+                 n_parsers: int = 2, batch_size: int = 100, queue_size: int = 256, rate_limit: float = 20.0) -> None:
         self.verbose = verbose
-        self.books_df = pd.DataFrame(columns=self.expected_cols)
-
-    def collect_data(self):
-        soup_main = self._get_data_from_url()
-
-        # Get categories and get books for each
-        category_link = self._get_all_category_links(soup_main)
-        # TODO parallel
-        for category, link in category_link.items():
-            if self.verbose:
-                print(f"Extracting {category} category, collected {self.books_df.shape[0]} items.")
-
-            full_url = self.BOOK_SHOP_BASE_URL + "/" + link
-            soup_category = self._get_data_from_url(full_url)
-            self._get_items_from_page_markup(soup_category, self.expected_cols, category, full_url)
-
-    def _get_data_from_url(self, url: str = BOOK_SHOP_URL) -> BeautifulSoup:
-        """"Extracts data from the given url."""
-        if url == '':
-            raise TypeError("URL must be non-empty.")
-            
-        try: 
-            page = urlopen(url)
-            markup = page.read().decode("utf-8")
-            soup = BeautifulSoup(markup=markup, features="html.parser")
-            return soup
-        except Exception as e:
-            print("Not valid url to ectract the data.", e)
-
-    def _get_book_url_from_main_page_book(self, book_class: BeautifulSoup):
-        try:
-            url = "catalogue/" + book_class.find('a', href=True).attrs.get("href").replace("../", "")
-            # name = book_class.find('img', attrs={"class": "thumbnail"}).attrs.get("alt")
-            # price = float(book_class.find('p', attrs={"class": "price_color"}).string[1:])
-            # avail = True if book_class.find('p', attrs={"instock availability"}).text.strip() == "In stock" else False
-        except Exception as e:
-            print("Impossible to fetch book data from the main page.", e)
-        return url
-
-    def _parse_desc_table(self, table:BeautifulSoup, expected: list):
-        all_keys = [th.text.lower() for th in table.findAll("th")]
-        assert all_keys == expected, "Unknown keys"
-
-        def prepare_val(key: str, val:str):
-            if 'price' in key or 'tax' in key:
-                return float(val[1:])
-            elif key == 'availability':
-                return int(''.join(filter(str.isdigit, val)))
-            elif key == "number of reviews":
-                return int(val)
-            else: 
-                return val
-
-        all_vals = [prepare_val(key, th.text) for key, th in zip(all_keys, table.findAll("td"))]
-
-        return dict(map(lambda i,j : (i,j) , all_keys, all_vals))
-
-    def _get_vals_from_description(self, book_class: BeautifulSoup, expected_cols: list):
-        try:
-            name = book_class.find("div", attrs={"class": "col-sm-6 product_main"}).find("h1").text
-            description_elem = book_class.find("div", attrs={"class": "sub-header", "id": "product_description"})
-            description = description_elem.next_element.next_element.next_element.next_element.next_element.next_element.text if description_elem else ""
-            rating = Rating[book_class.find("p", attrs={"class": "star-rating"}).attrs.get("class")[1]]
-
-            book_vals = self._parse_desc_table(book_class.find('table', attrs={"class": "table table-striped"}), expected_cols)
-            book_vals["description"] = description
-            book_vals["name"] = name
-            book_vals["rating"] = rating
-            return book_vals
-        except Exception as e:
-            print("Impossible to fetch book data from the description page.", e)
-
-    def _get_items_from_page_markup(self, soup: BeautifulSoup, expected_cols:list, category: str, category_url: str):
-        for book_class in soup.findAll('article', attrs={"class": "product_pod"}):
-            new_book_url = self._get_book_url_from_main_page_book(book_class)
-
-            # Get book data from description page and add to data frame
-            description = self._get_data_from_url(self.BOOK_SHOP_BASE_URL + "/" + new_book_url)
-            new_book = self._get_vals_from_description(description.find('article', attrs={"class": "product_page"}), expected_cols[5:])
-            new_book["url"] = new_book_url
-            new_book["category"] = category
-            self.books_df = self.books_df._append(new_book, ignore_index=True)
-
-            if self.verbose:
-                print(f"\t\tCollected 1 book {new_book.get('name')}.")
-
-        # Get data recursively from next pages
-        next_page = self._next_page_url(soup)
-        if next_page:
-            if self.verbose:
-                print("\tAnother page.")
-
-            next_soap = self._get_data_from_url(category_url.replace("index.html", "") + "/" + next_page)
-            self._get_items_from_page_markup(next_soap, expected_cols, category, category_url)
-
-
-    def _get_all_category_links(self, soup: BeautifulSoup):
-        all_generes = soup.find('ul', attrs={"class": "nav nav-list"}).findAll("a", href=True)
-        category_link = dict()
-        
-        # Skip books, then all categories
-        for genre in all_generes[1:]:
-            category_link[genre.text.strip().lower()] = genre['href']
-        return category_link
-
-    def _next_page_url(self, soup: BeautifulSoup):
-        buttons = soup.find('ul', attrs={"class": "pager"})
-        if buttons:
-            buttons = buttons.findAll("a", href=True)
-            next = [button["href"] for button in buttons if button.text == "next"]
-            return next[0] if len(next) > 0 else False
-        return False
-    
-    def save_to_csv(self, path:str = "data/last_update.csv"):
-        self.books_df.to_csv(path)
-
-book_scraper = BookDataScraper(verbose=True)
-book_scraper.collect_data()
-book_scraper.save_to_csv()
-print(book_scraper.books_df.shape)
+        self.parser_name = parser
+        self.parser = get_parser(parser)
+        self.crawler = AsyncCrawler(max_concurrency=max_concurrency, max_per_host=max_concurrency, rate_limit=rate_limit)
+        self.n_parsers = n_parsers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.rows_written = 0
+
+    def collect_data(self, path_out: str = "data/last_update.csv"):
+        """Extract all books into a CSV file (or Parquet if path ends with .parquet), returns number of rows."""
+        return asyncio.run(self._collect_data(path_out))
+
+    async def _collect_data(self, path_out: str):
+        book_urls = asyncio.Queue(self.queue_size)
+        book_pages = asyncio.Queue(self.queue_size)
+        rows = asyncio.Queue(self.queue_size)
+        n_fetchers = self.crawler.max_concurrency
+        writer = get_writer(path_out, self.expected_cols)
+
+        with ProcessPoolExecutor(max_workers=self.n_parsers) as executor:
+            async with self.crawler.session() as session:
+                async def walk_categories():
+                    try:
+                        markup_main, _ = await self.crawler.fetch(session, self.BOOK_SHOP_URL)
+                        category_link = self.parser.parse_category_links(markup_main)
+                        await asyncio.gather(*(walk_category(category, urljoin(self.BOOK_SHOP_URL, link))
+                                               for category, link in category_link.items()))
+                    finally:
+                        # Stop the next stages also on failure
+                        for _ in range(n_fetchers):
+                            await book_urls.put(None)
+
+                async def walk_category(category: str, url: str):
+                    while url:
+                        markup, _ = await self.crawler.fetch(session, url)
+                        if markup is None:
+                            return
+                        books, next_page = self.parser.parse_category_page(markup)
+                        for book_url, _ in books:
+                            await book_urls.put((book_url, category))
+                        url = urljoin(url, next_page) if next_page else None
+
+                        if self.verbose:
+                            print(f"Extracting {category} category, page with {len(books)} books.")
+
+                async def fetch_books():
+                    while (item := await book_urls.get()) is not None:
+                        markup, _ = await self.crawler.fetch(session, self.BOOK_SHOP_BASE_URL + "/" + item[0])
+                        if markup is not None:
+                            await book_pages.put((markup, ) + item)
+
+                async def fetch_all_books():
+                    await asyncio.gather(*(fetch_books() for _ in range(n_fetchers)))
+                    for _ in range(self.n_parsers):
+                        await book_pages.put(None)
+
+                async def parse_books():
+                    loop = asyncio.get_running_loop()
+                    while (item := await book_pages.get()) is not None:
+                        markup, book_url, category = item
+                        new_book = await loop.run_in_executor(
+                            executor, get_vals_from_description, self.parser_name, markup, self.expected_cols[5:])
+                        if new_book is not None:
+                            new_book["url"] = book_url
+                            new_book["category"] = category
+                            await rows.put(new_book)
+
+                async def parse_all_books():
+                    await asyncio.gather(*(parse_books() for _ in range(self.n_parsers)))
+                    await rows.put(None)
+
+                async def write_rows():
+                    batch = []
+                    while (row := await rows.get()) is not None:
+                        batch.append(row)
+                        if len(batch) >= self.batch_size:
+                            self._write_batch(writer, batch)
+                            batch = []
+                    if batch:
+                        self._write_batch(writer, batch)
+
+                await asyncio.gather(walk_categories(), fetch_all_books(), parse_all_books(), write_rows())
+
+        writer.close()
+        self.rows_written = writer.rows_written
+        return self.rows_written
+
+    def _write_batch(self, writer, batch: list):
+        writer.write(batch)
+        if self.verbose:
+            print(f"\tCollected {writer.rows_written} books.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the whole book shop into a CSV or Parquet file.")
+    parser.add_argument("path_out", nargs="?", default="data/last_update.csv")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--n-parsers", type=int, default=2)
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="requests per second to the shop, 0 for no limit")
+    args = parser.parse_args()
+
+    book_scraper = BookDataScraper(verbose=True, max_concurrency=args.max_concurrency, n_parsers=args.n_parsers,
+                                   rate_limit=args.rate_limit)
+    print(book_scraper.collect_data(args.path_out))
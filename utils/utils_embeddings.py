@@ -2,85 +2,157 @@ from nltk.stem import PorterStemmer
 from nltk.tokenize import word_tokenize
 from nltk.stem import PorterStemmer
 from nltk.stem import WordNetLemmatizer
-from nltk.corpus import stopwords 
+from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 import pandas as pd
 import numpy as np
 import gensim
 from gensim.models import Word2Vec
-import pickle
+from multiprocessing import Pool
+import argparse
+import os
+import sys
 import warnings
- 
+
 warnings.filterwarnings(action = 'ignore')
 
- 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_store import EmbeddingStore
+from convert_embeddings import convert_subword_vectors, convert_word_vectors
+
+# All paths are relative to the repository root, whatever the working directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(BASE_DIR, "data", "last_update_small.csv")
+CLEAN_DATA_PATH = os.path.join(BASE_DIR, "data", "clean_last_update_small.csv")
+MODEL_PATH = os.path.join(BASE_DIR, "embeddings", "word2vec.model")
+WORD_VECTORS_PATH = os.path.join(BASE_DIR, "embeddings", "word2vec.kv")
+SUBWORD_VECTORS_PATH = os.path.join(BASE_DIR, "embeddings", "subword_vectors")
+BOOK_VECTORS_PATH = os.path.join(BASE_DIR, "embeddings", "w2v_avg_vectors")
+
+
 def generate__store_embeddings(data, cols: list, path_out: str):
     model = gensim.models.Word2Vec(data[cols[0]], seed=0, workers=1, sg=0, min_count=1)
     [model.train(data[c], total_examples=data[c].shape[0], epochs=model.epochs) for c in cols[1:]]
     model.save(path_out)
 
 
-def preprocess(data: pd.DataFrame):    
-    stop_words = set(stopwords.words('english')) 
+def _tokenize_shard(texts: list):
+    return [word_tokenize(text.lower()) for text in texts]
+
+
+def _stem_shard(words: list):
     lemmatizer = WordNetLemmatizer()
     stemmer = PorterStemmer()
+    return [stemmer.stem(lemmatizer.lemmatize(word)) for word in words]
+
+
+def _map_sharded(pool: Pool, func, items: list, n_shards: int):
+    shard_size = max(1, -(-len(items) // n_shards))
+    shards = pool.map(func, [items[i:i + shard_size] for i in range(0, len(items), shard_size)])
+    return [item for shard in shards for item in shard]
+
+
+def preprocess(data: pd.DataFrame, n_jobs: int = None, descriptions: bool = True):
+    """Tokenize, lemmatize and stem names and descriptions (only used to train the model, can be skipped).
+
+    Tokenization is sharded across processes, then every distinct word is lemmatized and stemmed only once
+    (also sharded) and the tokens are mapped through this shared vocabulary.
+    """
+    n_jobs = n_jobs or os.cpu_count()
 
-    names, descriptions = [], []
-    for _, doc in data.iterrows():
-        row_name = doc["name"].lower()
-        row_desc = doc["description"].lower()
+    with Pool(n_jobs) as pool:
+        name_tokens = _map_sharded(pool, _tokenize_shard, data["name"].tolist(), n_jobs)
+        desc_tokens = []
+        if descriptions:
+            stop_words = set(stopwords.words('english'))
+            desc_tokens = _map_sharded(pool, _tokenize_shard, data["description"].tolist(), n_jobs)
+            desc_tokens = [[word for word in tokens if not word in stop_words and word.isalpha()] for tokens in desc_tokens]
 
-        name_t, desc_t = [], []
-        tokens = word_tokenize(row_name)
-        for word in tokens:
-            # not word in stop_words
-            if word.isalpha() or len(tokens) < 2:
-                name_t.append(stemmer.stem(lemmatizer.lemmatize(word)))
+        # not word in stop_words for names
+        name_tokens = [[word for word in tokens if word.isalpha() or len(tokens) < 2] for tokens in name_tokens]
 
+        vocabulary = sorted({word for tokens in name_tokens + desc_tokens for word in tokens})
+        stems = dict(zip(vocabulary, _map_sharded(pool, _stem_shard, vocabulary, n_jobs)))
+
+    names = [[stems[word] for word in tokens] for tokens in name_tokens]
+    for name_t, row_name in zip(names, data["name"]):
         if len(name_t) < 1:
             print(name_t)
-            print(row_name)
-
-        names.append(name_t)
-        
-        for word in word_tokenize(row_desc):
-            if not word in stop_words and word.isalpha():
-                desc_t.append(stemmer.stem(lemmatizer.lemmatize(word)))    
-        descriptions.append(' '.join(desc_t))
+            print(row_name.lower())
+
     data["name_clean"] = names
-    data["description_clean"] = descriptions
+    if descriptions:
+        data["description_clean"] = [' '.join(stems[word] for word in tokens) for tokens in desc_tokens]
 
     return data
 
 def avg_book_embedings(model, data, col: str):
-    vectors = []
-
-    for _, doc in data.iterrows():
-        vec = []
-        for word in doc[col]:
-            vec.append(model.wv[word])
-        vectors.append(np.array(np.mean(vec, axis=0)))
-    
-    return vectors
-
-def main ():
-    # Preprocess data
-    in_data = pd.read_csv("../data/last_update_small.csv")
+    """Mean word vector of every row, gathered from model.wv.vectors by token ids and averaged in one batch.
+
+    Words out of the model vocabulary are skipped, rows without known words get a zero vector.
+    """
+    key_to_index = model.wv.key_to_index
+    token_ids = [[key_to_index[word] for word in tokens if word in key_to_index] for tokens in data[col]]
+    lengths = np.array([len(ids) for ids in token_ids])
+
+    vectors = np.zeros((len(token_ids), model.wv.vector_size), dtype=np.float32)
+    non_empty = lengths > 0
+    if non_empty.any():
+        flat_ids = np.fromiter((i for ids in token_ids for i in ids), dtype=np.int64, count=int(lengths.sum()))
+        starts = np.cumsum(lengths) - lengths
+        sums = np.add.reduceat(model.wv.vectors[flat_ids], starts[non_empty], axis=0)
+        vectors[non_empty] = sums / lengths[non_empty, None]
+
+    return list(vectors)
+
+def update_store(store: EmbeddingStore, model, data: pd.DataFrame, col: str):
+    """Store for the books in data, only books that are not in the given store are embedded (col is only read for them)."""
+    names = data["name"].str.lower().tolist()
+    rows = store.rows(names) if store is not None else np.full(len(names), -1)
+    new = rows < 0
+
+    vectors = np.zeros((len(names), model.wv.vector_size), dtype=np.float32)
+    if store is not None:
+        vectors[~new] = store.vectors[rows[~new]]
+    if new.any():
+        vectors[new] = np.array(avg_book_embedings(model, data[new], col))
+    print(f"Embedded {int(new.sum())} new books, reused {int((~new).sum())}.")
+
+    # Names are keys of the store, duplicates keep the last row
+    unique = dict(zip(names, range(len(names))))
+    return EmbeddingStore(list(unique), vectors[list(unique.values())])
+
+def main (incremental: bool = False, n_jobs: int = None):
+    in_data = pd.read_csv(DATA_PATH)
     in_data.fillna(inplace=True, value="")
-    res = preprocess(in_data)
-    res.to_csv("data/clean_last_update_small.csv", index=False)
+
+    # Incremental rebuild keeps the model so stored vectors stay valid, only unknown books are preprocessed
+    store = EmbeddingStore.load(BOOK_VECTORS_PATH, mmap_mode=None) \
+        if incremental and EmbeddingStore.exists(BOOK_VECTORS_PATH) else None
+    if store is not None:
+        known = store.rows(in_data["name"].str.lower().tolist()) >= 0
+        res = preprocess(in_data[~known].reset_index(drop=True), n_jobs, descriptions=False) if not known.all() else None
+        data = pd.concat([in_data[known], res]) if res is not None else in_data
+    else:
+        # Preprocess data, descriptions are only needed to train the model
+        data = preprocess(in_data, n_jobs, descriptions=not incremental)
+        if not incremental:
+            data.to_csv(CLEAN_DATA_PATH, index=False)
 
     # Generate embeddings
-    model_path, avg_book_vec = "../embeddings/word2vec.model", 'embeddings/w2v_avg_vectors.p'
-    generate__store_embeddings(res, ["name_clean"], model_path)
+    if not incremental:
+        generate__store_embeddings(data, ["name_clean"], MODEL_PATH)
+        # Word vectors only, memory-mapped by the search engine
+        convert_word_vectors(MODEL_PATH, WORD_VECTORS_PATH)
+        convert_subword_vectors(WORD_VECTORS_PATH, SUBWORD_VECTORS_PATH)
 
     # Embedd book names
-    model = Word2Vec.load(model_path)
-    emb = avg_book_embedings(model, res, "name_clean")
+    model = Word2Vec.load(MODEL_PATH)
+    update_store(store, model, data, "name_clean").save(BOOK_VECTORS_PATH)
 
-    emb_dict = {res["name"].iloc[i].lower(): emb[i] for i in range(len(emb))}
-    with open(avg_book_vec, 'wb') as fp:
-        pickle.dump(emb_dict, fp, protocol=pickle.HIGHEST_PROTOCOL)
-    
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train word2vec and store averaged book name embeddings.")
+    parser.add_argument("--incremental", action="store_true", help="keep the model, embed only new books")
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+    main(args.incremental, args.n_jobs)